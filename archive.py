@@ -0,0 +1,224 @@
+import os
+import sys
+import glob
+import multiprocessing
+import numpy as np
+from pyais import decode
+import nmea
+
+# Columnar AIS archive: one directory per day file, one .npy per field
+# archive/2022-11-16/epoch_time.npy, archive/2022-11-16/mmsi.npy, ...
+# Decode the raw NMEA once with ingestFile(), then loadArchive() memory-maps
+# the columns so the analysis never goes through pyais again.
+
+archiveDir = "archive"
+dataDir = "data"
+
+# Field name >> fixed-width type on disk
+archiveFields = {
+    "epoch_time": np.float64,  # receive time, s (ms resolution in newer files)
+    "mmsi": np.uint32,
+    "msg_type": np.uint8,
+    "lat": np.float64,
+    "lon": np.float64,
+    "speed": np.float64,
+    "course": np.float64,
+    "heading": np.uint16,
+}
+
+# Values stored when a decoded message does not carry the field
+missingValues = {
+    "lat": np.nan,
+    "lon": np.nan,
+    "speed": np.nan,
+    "course": np.nan,
+    "heading": 511,  # AIS "not available"
+}
+
+
+def readAISColumns(fileName):
+    # Decode a day file into typed columns (one row per complete message)
+    # Position reports are collected and decoded as one batch by nmea.py,
+    # everything else goes through pyais; rows keep the file order.
+    positionalPayloads = []
+    positionalRows = []
+    positionalTimes = []
+    AISMessages = []
+    otherRows = []
+    assembler = nmea.MultipartAssembler()
+    row = 0
+    with open(fileName) as csvFile:
+        for line in csvFile:
+            parts = line.split()  # "1668496136 !AIVDM...."
+            if len(parts) < 2:
+                continue
+            msgRecvTime = parts[0]
+            msg = parts[1]
+            sentences = assembler.push(msg, msgRecvTime)
+            if sentences is None:
+                # Need more parts for the multipart msg.
+                continue
+            if len(sentences) == 1:
+                payload = nmea.getPayload(msg)
+                if nmea.isPositional(payload):
+                    positionalPayloads.append(payload)
+                    positionalTimes.append(msgRecvTime)
+                    positionalRows.append(row)
+                    row += 1
+                    continue
+            try:
+                # Decoded exactly once per complete message
+                decodedMsg = decode(*sentences).asdict()
+            except:
+                # Failed: Corrupt sentence.
+                continue
+            decodedMsg["epoch_time"] = msgRecvTime
+            AISMessages.append(decodedMsg)
+            otherRows.append(row)
+            row += 1
+    positional = nmea.decodePositionReports(positionalPayloads)
+    positional["epoch_time"] = np.array(positionalTimes, dtype=archiveFields["epoch_time"])
+    others = toColumns(AISMessages)
+    order = np.argsort(np.array(positionalRows + otherRows), kind="stable")
+    columns = {}
+    for field, dtype in archiveFields.items():
+        merged = np.concatenate([positional[field].astype(dtype), others[field]])
+        columns[field] = merged[order]
+    return columns
+
+
+def toColumns(msgDictList):
+    # List of message dicts >> dict of typed NumPy columns
+    columns = {}
+    for field, dtype in archiveFields.items():
+        missing = missingValues.get(field, 0)
+        values = []
+        for msg in msgDictList:
+            value = msg.get(field)
+            if value is None:
+                value = missing
+            values.append(value)
+        columns[field] = np.array(values, dtype=dtype)
+    return columns
+
+
+def getArchivePath(fileName):
+    dayName = os.path.splitext(os.path.basename(fileName))[0]
+    return os.path.join(archiveDir, dayName)
+
+
+def isArchived(fileName):
+    # Archive is valid if every column exists and is newer than the day file
+    archivePath = getArchivePath(fileName)
+    for field in archiveFields:
+        columnPath = os.path.join(archivePath, f"{field}.npy")
+        if not os.path.exists(columnPath):
+            return False
+        if os.path.getmtime(columnPath) < os.path.getmtime(fileName):
+            return False
+    return True
+
+
+def writeArchive(columns, archivePath):
+    os.makedirs(archivePath, exist_ok=True)
+    for field in archiveFields:
+        np.save(os.path.join(archivePath, f"{field}.npy"), columns[field])
+
+
+def ingestFile(fileName, force=False):
+    # One-time conversion of a day file (data/YYYY-MM-DD.csv) into the archive
+    archivePath = getArchivePath(fileName)
+    if force or not isArchived(fileName):
+        columns = readAISColumns(fileName)
+        writeArchive(columns, archivePath)
+    return archivePath
+
+
+def loadArchive(archivePath, mmap=True):
+    # Columns are memory-mapped read-only unless mmap is False
+    mmapMode = "r" if mmap else None
+    columns = {}
+    for field in archiveFields:
+        columnPath = os.path.join(archivePath, f"{field}.npy")
+        columns[field] = np.load(columnPath, mmap_mode=mmapMode)
+    return columns
+
+
+def loadDay(fileName):
+    # Ingest on first use, memory-map afterwards
+    return loadArchive(ingestFile(fileName))
+
+
+def toMsgDictList(columns, indices=None, startTime=0):
+    # Rebuild message dicts (e.g. for export.py) from selected rows
+    # epoch_time is made relative to startTime when one is given
+    if indices is None:
+        indices = range(len(columns["mmsi"]))
+    msgDictList = []
+    for i in indices:
+        msg = {}
+        for field in archiveFields:
+            msg[field] = columns[field][i].item()
+        msg["epoch_time"] -= startTime
+        msgDictList.append(msg)
+    return msgDictList
+
+
+def getDayFiles(startDate=None, endDate=None):
+    # Day files in data/ between two "YYYY-MM-DD" dates (inclusive), all if None
+    dayFiles = []
+    for fileName in sorted(glob.glob(os.path.join(dataDir, "*.csv"))):
+        dayName = os.path.splitext(os.path.basename(fileName))[0]
+        if startDate is not None and dayName < startDate:
+            continue
+        if endDate is not None and dayName > endDate:
+            continue
+        dayFiles.append(fileName)
+    return dayFiles
+
+
+def ingestDays(dayFiles, processes=None, force=False):
+    # Days are independent (multipart state never spans files): one per worker
+    # No pool when there is at most one day left to decode
+    pending = [fileName for fileName in dayFiles if force or not isArchived(fileName)]
+    if len(pending) <= 1:
+        return [ingestFile(fileName, force) for fileName in dayFiles]
+    with multiprocessing.Pool(processes) as pool:
+        archivePaths = pool.starmap(
+            ingestFile, [(fileName, force) for fileName in dayFiles]
+        )
+    return archivePaths
+
+
+def mergeArchives(archivePaths):
+    # Concatenate day columns into one stream sorted by vessel, then time
+    dayColumns = [loadArchive(archivePath) for archivePath in archivePaths]
+    columns = {}
+    for field in archiveFields:
+        columns[field] = np.concatenate(
+            [day[field] for day in dayColumns]
+        ).astype(archiveFields[field], copy=False)
+    order = np.lexsort((columns["epoch_time"], columns["mmsi"]))
+    for field in archiveFields:
+        columns[field] = columns[field][order]
+    return columns
+
+
+def loadDays(startDate=None, endDate=None, processes=None):
+    # Ingest any missing days in parallel, then merge the whole range
+    dayFiles = getDayFiles(startDate, endDate)
+    if not dayFiles:
+        raise FileNotFoundError(f"No day files in {dataDir}/ for {startDate}..{endDate}")
+    archivePaths = ingestDays(dayFiles, processes)
+    return mergeArchives(archivePaths)
+
+
+if __name__ == "__main__":
+    # RUN: python archive.py [startDate] [endDate]  (e.g. 2022-11-15 2022-11-20)
+    # No dates: (re)ingest all of data/
+    startDate = sys.argv[1] if len(sys.argv) > 1 else None
+    endDate = sys.argv[2] if len(sys.argv) > 2 else startDate
+    dayFiles = getDayFiles(startDate, endDate)
+    archivePaths = ingestDays(dayFiles, force=True)
+    for fileName, archivePath in zip(dayFiles, archivePaths):
+        print(f"{fileName} >> {archivePath}")
@@ -0,0 +1,350 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+
+# AIS capture service: reads N NMEA sources concurrently and appends tagged
+# records to the same data/YYYY-MM-DD.csv layout as main.py:
+#   "1668496136.123 !AIVDM,1,1,,A,16=q?8hP015eSA03vqtA2wvF0@6E,0*56 COM5"
+# Receive times are taken from receiveClock with millisecond precision
+# (timePrecision=0 writes the old whole-second format).
+# The source name is a third column, readers only use the first two.
+# Sources feed one bounded queue: when the writer falls behind, stream sources
+# (serial, TCP, replay) wait on the queue and UDP datagrams are dropped and
+# counted, so memory stays bounded.
+
+
+class ReceiveClock:
+    # Wall clock time anchored once, then advanced by the monotonic clock:
+    # sub-second resolution, never steps backwards (NTP/DST adjustments).
+    # Checked against the wall clock every resyncInterval: when the wall clock
+    # is more than maxDrift ahead it is re-anchored (steps forward), when it is
+    # more than maxDrift behind (stepped back) the clock keeps advancing but
+    # slower, by slewRate of the monotonic rate, until it has caught up.
+
+    def __init__(self, maxDrift=1.0, resyncInterval=60, slewRate=0.5):
+        self.maxDrift = maxDrift
+        self.resyncInterval = resyncInterval
+        self.slewRate = slewRate
+        self.lastTime = 0
+        self.anchor()
+
+    def anchor(self):
+        self.wallAnchor = time.time()
+        self.monoAnchor = time.monotonic()
+        self.slew = 0  # Seconds ahead of the wall clock still to give up
+
+    def fold(self, elapsed):
+        # Moves the anchor elapsed monotonic seconds forward
+        slewed = min(self.slew, self.slewRate * elapsed)
+        self.wallAnchor += elapsed - slewed
+        self.monoAnchor += elapsed
+        self.slew -= slewed
+
+    def now(self):
+        elapsed = time.monotonic() - self.monoAnchor
+        if elapsed >= self.resyncInterval:
+            self.fold(elapsed)
+            ahead = self.wallAnchor - time.time()
+            if ahead < -self.maxDrift:
+                self.anchor()
+            elif ahead > self.maxDrift:
+                self.slew = ahead
+            elapsed = time.monotonic() - self.monoAnchor
+        slewed = min(self.slew, self.slewRate * elapsed)
+        self.lastTime = max(self.lastTime, self.wallAnchor + elapsed - slewed)
+        return self.lastTime
+
+
+receiveClock = ReceiveClock()
+
+
+class ReplayClock:
+    # Recorded time of a replay: startTime until start(), then advanced by the
+    # monotonic clock times the playback speed
+
+    def __init__(self, startTime=0, speed=1):
+        self.startTime = startTime
+        self.speed = speed
+        self.monoAnchor = None
+
+    def start(self):
+        self.monoAnchor = time.monotonic()
+
+    def now(self):
+        if self.monoAnchor is None:
+            return self.startTime
+        return self.startTime + (time.monotonic() - self.monoAnchor) * self.speed
+
+
+def splitSentences(aisBuffer):
+    # Pops complete "\r\n" terminated sentences off a bytearray buffer
+    sentences = []
+    while True:
+        end = aisBuffer.find(b"\n")
+        if end < 0:
+            break
+        # Drop stray non-ASCII bytes (line noise) instead of crashing
+        sentence = aisBuffer[:end].decode("ascii", "ignore").strip()
+        del aisBuffer[: end + 1]
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+class DayWriter:
+    # Appends records through one persistent handle per day file
+    # Flushed every flushRecords records or flushInterval seconds, reopened at midnight
+    # timePrecision: decimals of the receive time (3: ms, 0: legacy whole seconds)
+
+    def __init__(self, dataDir="data", flushInterval=5, flushRecords=200, timePrecision=3):
+        self.dataDir = dataDir
+        self.timePrecision = timePrecision
+        self.flushInterval = flushInterval
+        self.flushRecords = flushRecords
+        self.csvFile = None
+        self.nextRollover = 0  # Epoch time of the next midnight
+        self.pendingRecords = 0
+        self.lastFlush = receiveClock.now()
+
+    def open(self, now):
+        if self.csvFile is not None:
+            self.csvFile.close()
+        dateToday = datetime.fromtimestamp(now)
+        fileName = "{}/{}.csv".format(self.dataDir, dateToday.strftime("%Y-%m-%d"))
+        self.csvFile = open(fileName, "a")
+        midnight = datetime(dateToday.year, dateToday.month, dateToday.day)
+        self.nextRollover = (midnight + timedelta(days=1)).timestamp()
+
+    def write(self, now, aisMessage, source=None):
+        if now >= self.nextRollover:
+            self.open(now)
+        if self.timePrecision > 0:
+            recvTime = "{:.{}f}".format(now, self.timePrecision)
+        else:
+            recvTime = str(int(now))
+        aisRecord = "{} {}".format(recvTime, aisMessage)
+        if source is not None:
+            aisRecord += " {}".format(source)
+        self.csvFile.write(aisRecord + "\n")
+        self.pendingRecords += 1
+        if self.pendingRecords >= self.flushRecords:
+            self.flush(now)
+        return aisRecord
+
+    def flush(self, now):
+        if self.csvFile is not None and self.pendingRecords > 0:
+            self.csvFile.flush()
+        self.pendingRecords = 0
+        self.lastFlush = now
+
+    def flushIfDue(self, now):
+        if now - self.lastFlush >= self.flushInterval:
+            self.flush(now)
+
+    def close(self):
+        if self.csvFile is not None:
+            self.flush(receiveClock.now())
+            self.csvFile.close()
+            self.csvFile = None
+
+
+class Source(ABC):
+    # Base class: counts records/bytes/drops and pushes (time, sentence, name)
+    # Subclasses implement run(queue), reading their input until cancelled
+    # clock: time base of the pushed times (receiveClock for live receivers)
+
+    def __init__(self, name, clock=receiveClock):
+        self.name = name
+        self.clock = clock
+        self.records = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    async def emit(self, queue, sentence, recvTime=None):
+        if recvTime is None:
+            recvTime = self.clock.now()
+        await queue.put((recvTime, sentence, self.name))
+        self.records += 1
+        self.bytes += len(sentence) + 2
+
+    def emitNowait(self, queue, sentence):
+        try:
+            queue.put_nowait((self.clock.now(), sentence, self.name))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return
+        self.records += 1
+        self.bytes += len(sentence) + 2
+
+    @abstractmethod
+    async def run(self, queue):
+        pass
+
+
+class SerialSource(Source):
+    # Serial receiver (e.g. "COM5" at 38400 baud), blocking reads in a thread
+
+    def __init__(self, port, baudrate=38400, name=None):
+        super().__init__(name or port)
+        self.port = port
+        self.baudrate = baudrate
+
+    async def run(self, queue):
+        import serial  # Only needed for serial receivers
+
+        c_port = serial.Serial(self.port, self.baudrate, timeout=0.5)
+        loop = asyncio.get_running_loop()
+        aisBuffer = bytearray()
+        try:
+            while True:
+                aisBuffer += await loop.run_in_executor(
+                    None, lambda: c_port.read(c_port.in_waiting or 1)
+                )
+                for sentence in splitSentences(aisBuffer):
+                    await self.emit(queue, sentence)
+        finally:
+            c_port.close()
+
+
+class TCPSource(Source):
+    # NMEA over TCP (e.g. a networked receiver on port 10110), reconnects on loss
+
+    def __init__(self, host, port, name=None, retryDelay=5):
+        super().__init__(name or f"tcp:{host}:{port}")
+        self.host = host
+        self.port = port
+        self.retryDelay = retryDelay
+
+    async def run(self, queue):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(self.retryDelay)
+                continue
+            try:
+                aisBuffer = bytearray()
+                while True:
+                    chunk = await reader.read(4096)
+                    if not chunk:
+                        break
+                    aisBuffer += chunk
+                    for sentence in splitSentences(aisBuffer):
+                        await self.emit(queue, sentence)
+            except OSError:
+                pass
+            finally:
+                writer.close()
+            await asyncio.sleep(self.retryDelay)
+
+
+class UDPSource(Source):
+    # NMEA datagrams (one or more sentences each), dropped when the queue is full
+
+    def __init__(self, host="0.0.0.0", port=10110, name=None):
+        super().__init__(name or f"udp:{port}")
+        self.host = host
+        self.port = port
+
+    async def run(self, queue):
+        source = self
+
+        class Protocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                for sentence in splitSentences(bytearray(data) + b"\n"):
+                    source.emitNowait(queue, sentence)
+
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            Protocol, local_addr=(self.host, self.port)
+        )
+        try:
+            await asyncio.Event().wait()  # Run until cancelled
+        finally:
+            transport.close()
+
+
+class ReplaySource(Source):
+    # Replays a recorded day file as a live receiver (speed: playback factor)
+    # Sentences keep their recorded time, self.clock runs in that time (starts
+    # at the first record), so reported speeds stay consistent at any speed.
+    # Record a replay into another dataDir: its times are those of the file.
+
+    def __init__(self, fileName, speed=1, name=None):
+        super().__init__(name or f"replay:{fileName}", ReplayClock(self.getStartTime(fileName), speed))
+        self.fileName = fileName
+        self.speed = speed
+
+    @staticmethod
+    def getStartTime(fileName):
+        with open(fileName) as csvFile:
+            for line in csvFile:
+                parts = line.split()
+                if len(parts) >= 2:
+                    return float(parts[0])
+        return 0
+
+    async def run(self, queue):
+        self.clock.start()
+        with open(self.fileName) as csvFile:
+            for line in csvFile:
+                parts = line.split()
+                if len(parts) < 2:
+                    continue
+                recvTime = float(parts[0])
+                delay = (recvTime - self.clock.now()) / self.speed
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.emit(queue, parts[1], recvTime)
+
+
+async def writeRecords(queue, dayWriter, echo=False):
+    while True:
+        now, sentence, source = await queue.get()
+        aisRecord = dayWriter.write(now, sentence, source)
+        queue.task_done()
+        if echo:
+            print(aisRecord)
+
+
+async def reportStats(sources, queue, dayWriter, interval):
+    # Periodic flush plus per-source throughput (records/s since last report)
+    lastRecords = {source.name: 0 for source in sources}
+    while True:
+        await asyncio.sleep(interval)
+        dayWriter.flushIfDue(receiveClock.now())
+        for source in sources:
+            rate = (source.records - lastRecords[source.name]) / interval
+            lastRecords[source.name] = source.records
+            print(
+                f"{source.name}: {rate:.1f} rec/s, {source.records} records, "
+                f"{source.bytes} bytes, {source.dropped} dropped, queue {queue.qsize()}"
+            )
+
+
+async def runCapture(sources, dayWriter=None, queueSize=10000, statsInterval=5, echo=False):
+    # Runs until every finite source (replay) is done, live sources run forever
+    if dayWriter is None:
+        dayWriter = DayWriter(flushInterval=statsInterval)
+    queue = asyncio.Queue(maxsize=queueSize)
+    writer = asyncio.create_task(writeRecords(queue, dayWriter, echo))
+    stats = asyncio.create_task(reportStats(sources, queue, dayWriter, statsInterval))
+    try:
+        await asyncio.gather(*[source.run(queue) for source in sources])
+        await queue.join()  # Let the writer drain what is left
+    finally:
+        writer.cancel()
+        stats.cancel()
+        dayWriter.close()
+
+
+if __name__ == "__main__":
+    sources = [
+        SerialSource("COM5", 38400),
+        # SerialSource("COM6", 38400),
+        # TCPSource("192.168.1.10", 10110),
+        # UDPSource("0.0.0.0", 10110),
+        # ReplaySource("data/2022-11-16.csv", speed=10),
+    ]
+    asyncio.run(runCapture(sources, echo=True))
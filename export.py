@@ -1,11 +1,13 @@
 import csv
+import numpy as np
 from datetime import datetime
-import utils
+import projection
 
 defaultFileName = datetime.now().strftime("%Y-%m-%d-%H-%M")
 
 # Format messages for Unreal: ID, Timestamp, MMSI, Latitude, Longitude, Speed, Course, Heading
-def writeCSVForUnreal(msgDictList, fileName=defaultFileName):
+# append: add rows to an existing file (header only written for a new file)
+def writeCSVForUnreal(msgDictList, fileName=defaultFileName, append=False, startID=0):
     csvFields = [
         "ID",
         "Timestamp",
@@ -17,7 +19,7 @@ def writeCSVForUnreal(msgDictList, fileName=defaultFileName):
         "Heading",
     ]
     csvData = []
-    i = 0
+    i = startID
     for msg in msgDictList:
         singleRecord = [
             i,
@@ -31,25 +33,137 @@ def writeCSVForUnreal(msgDictList, fileName=defaultFileName):
         ]
         csvData.append(singleRecord)
         i += 1
-    with open(f"out/{fileName}.unreal.csv", "w", newline="") as csvFile:
+    with open(f"out/{fileName}.unreal.csv", "a" if append else "w", newline="") as csvFile:
         writer = csv.writer(csvFile)
-        writer.writerow(csvFields)
+        if not append or csvFile.tell() == 0:
+            writer.writerow(csvFields)
         writer.writerows(csvData)
 
 
 # Format messages for Octave: Timestamp, MMSI, x, y, Speed, Course
-def writeCSVForOctave(msgDictList, fileName=defaultFileName):
+# startID is unused (no ID column), kept so both writers take the same arguments
+# x, y of the whole list are projected in one call (projection.py)
+def writeCSVForOctave(
+    msgDictList, fileName=defaultFileName, append=False, startID=0,
+    flatProjection=projection.defaultProjection,
+):
+    lats = [float(msg["lat"]) for msg in msgDictList]
+    lons = [float(msg["lon"]) for msg in msgDictList]
+    flatX, flatY = flatProjection.toFlat(lats, lons)
     csvData = []
-    for msg in msgDictList:
+    for i, msg in enumerate(msgDictList):
         singleRecord = [
             msg["epoch_time"],
             msg["mmsi"],
-            utils.computeFlatX(float(msg["lon"])),
-            utils.computeFlatY(float(msg["lat"])),
+            flatX[i].item(),
+            flatY[i].item(),
             msg["speed"],
             msg["course"],
         ]
         csvData.append(singleRecord)
-    with open(f"out/{fileName}.octave.csv", "w", newline="") as csvFile:
+    with open(f"out/{fileName}.octave.csv", "a" if append else "w", newline="") as csvFile:
         writer = csv.writer(csvFile)
         writer.writerows(csvData)
+
+
+# Binary format for Unreal (little-endian, memory-mappable): out/{fileName}.unreal.bin
+#   header        : magic "AISU", version, record size, vessel count, record count
+#                   (24 bytes, so the vessel table and records start 8-aligned)
+#   vessel table  : per vessel MMSI, first record index, record count, first/last time
+#   records       : fixed-size, grouped by vessel (MMSI ascending) then time
+# A loader can seek to a vessel through the table and to a time window by
+# binary search on the vessel's (sorted) timestamps.
+binaryMagic = b"AISU"
+binaryVersion = 1
+binaryHeader = np.dtype(
+    [
+        ("magic", "S4"),
+        ("version", "<u2"),
+        ("recordSize", "<u2"),
+        ("vesselCount", "<u4"),
+        ("reserved", "<u4"),
+        ("recordCount", "<u8"),
+    ]
+)
+binaryVessel = np.dtype(
+    [
+        ("mmsi", "<u4"),
+        ("reserved", "<u4"),
+        ("offset", "<u8"),  # index of the first record
+        ("count", "<u8"),
+        ("startTime", "<f8"),
+        ("endTime", "<f8"),
+    ]
+)
+# Ordered for natural alignment (8 byte fields first), 48 bytes per record
+# id: row of the record in the export (ID column of the Unreal CSV)
+binaryRecord = np.dtype(
+    [
+        ("timestamp", "<f8"),
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+        ("mmsi", "<u4"),
+        ("id", "<u4"),
+        ("speed", "<f4"),
+        ("course", "<f4"),
+        ("heading", "<u2"),
+        ("reserved", "<u2", 3),
+    ]
+)
+
+
+def writeBinaryForUnreal(msgDictList, fileName=defaultFileName):
+    records = np.zeros(len(msgDictList), dtype=binaryRecord)
+    records["timestamp"] = [float(msg["epoch_time"]) for msg in msgDictList]
+    records["lat"] = [msg["lat"] for msg in msgDictList]
+    records["lon"] = [msg["lon"] for msg in msgDictList]
+    records["mmsi"] = [msg["mmsi"] for msg in msgDictList]
+    records["speed"] = [msg["speed"] for msg in msgDictList]
+    records["course"] = [msg["course"] for msg in msgDictList]
+    records["heading"] = [msg["heading"] for msg in msgDictList]
+    records["id"] = np.arange(len(msgDictList))  # as writeCSVForUnreal
+    writeBinaryRecords(records, fileName)
+
+
+def writeBinaryRecords(records, fileName=defaultFileName):
+    # records: binaryRecord array in any order
+    records = records[np.lexsort((records["id"], records["timestamp"], records["mmsi"]))]
+
+    vessels, offsets, counts = np.unique(
+        records["mmsi"], return_index=True, return_counts=True
+    )
+    vesselTable = np.zeros(len(vessels), dtype=binaryVessel)
+    vesselTable["mmsi"] = vessels
+    vesselTable["offset"] = offsets
+    vesselTable["count"] = counts
+    vesselTable["startTime"] = records["timestamp"][offsets]
+    vesselTable["endTime"] = records["timestamp"][offsets + counts - 1]
+
+    header = np.zeros(1, dtype=binaryHeader)
+    header["magic"] = binaryMagic
+    header["version"] = binaryVersion
+    header["recordSize"] = binaryRecord.itemsize
+    header["vesselCount"] = len(vessels)
+    header["recordCount"] = len(records)
+    with open(f"out/{fileName}.unreal.bin", "wb") as binFile:
+        binFile.write(header.tobytes())
+        binFile.write(vesselTable.tobytes())
+        binFile.write(records.tobytes())
+
+
+def loadBinaryForUnreal(fileName):
+    # Memory-maps a binary export: (vessel table, records)
+    filePath = f"out/{fileName}.unreal.bin"
+    header = np.fromfile(filePath, dtype=binaryHeader, count=1)[0]
+    if header["magic"] != binaryMagic or header["version"] != binaryVersion:
+        raise ValueError(f"{filePath} is not a version {binaryVersion} AIS binary export")
+    vesselTable = np.memmap(
+        filePath, dtype=binaryVessel, mode="r", offset=binaryHeader.itemsize,
+        shape=(int(header["vesselCount"]),),
+    )
+    records = np.memmap(
+        filePath, dtype=binaryRecord, mode="r",
+        offset=binaryHeader.itemsize + vesselTable.nbytes,
+        shape=(int(header["recordCount"]),),
+    )
+    return vesselTable, records
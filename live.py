@@ -0,0 +1,252 @@
+import os
+import sys
+import time
+import asyncio
+import numpy as np
+import nmea, export
+from projection import defaultProjection
+from capture import SerialSource, TCPSource, UDPSource, ReplaySource, DayWriter, receiveClock
+
+# The trackers live in validate/algo (validate/ scripts import them as "algo")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "validate"))
+from algo.agb import AISReport
+from algo.trackers import AGBTracker
+from algo.utils import rad2course
+
+# Live tracker service for the VR scene:
+#   capture sources (serial, TCP, UDP or a replayed day file) >> position reports
+#   >> one tracker per MMSI >> interpolated positions of all active vessels,
+#   served every render tick to clients on a local TCP socket.
+# Frame layout (little-endian): liveHeader, then `count` export.binaryRecord
+# records (same record as out/*.unreal.bin, timestamp is the tick time, id 0).
+# A tick only spends tickBudget seconds on trackers: vessels not reached keep
+# their previous position and go first on the next tick. Vessels without a
+# report for evictAfter seconds are dropped. Clients that cannot keep up skip
+# frames instead of buffering them.
+
+liveMagic = b"AISL"
+liveHeader = np.dtype([("magic", "S4"), ("time", "<f8"), ("count", "<u4")])
+
+knotsToMs = 1 / 1.94384
+
+
+def isValidReport(msg):
+    # Type 1/2/3 with position, speed and course available
+    return (
+        msg is not None
+        and msg["msg_type"] in [1, 2, 3]
+        and abs(msg["lat"]) <= 90
+        and abs(msg["lon"]) <= 180
+        and msg["speed"] < 102.3
+        and msg["course"] < 360
+    )
+
+
+class LiveVessels:
+    # trackerFactory() >> new tracker for a vessel (see validate/algo/trackers.py)
+
+    def __init__(self, trackerFactory, evictAfter=360, tickBudget=0.005, clock=receiveClock):
+        self.trackerFactory = trackerFactory
+        self.clock = clock  # Time base of the reports (a ReplaySource's clock for replays)
+        self.evictAfter = evictAfter
+        self.tickBudget = tickBudget
+        self.startTime = clock.now()  # Tracker times are relative to this
+        self.trackers = {}  # MMSI >> tracker
+        self.lastReport = {}  # MMSI >> (receive time, report)
+        self.records = {}  # MMSI >> last served export.binaryRecord
+        self.order = []  # MMSIs, vessels not reached on the last tick first
+        self.reports = 0
+        self.evicted = 0
+        self.overruns = 0  # Ticks that ran out of budget
+
+    def ingest(self, recvTime, msg):
+        mmsi = msg["mmsi"]
+        x, y = defaultProjection.toFlat(msg["lat"], msg["lon"])
+        report = AISReport(
+            recvTime - self.startTime,
+            float(x),
+            float(y),
+            msg["speed"] * knotsToMs,
+            msg["course"],
+        )
+        if mmsi in self.trackers:
+            lastTime, lastReport = self.lastReport[mmsi]
+            if (report.posX, report.posY, report.speed, report.course) == (
+                lastReport.posX, lastReport.posY, lastReport.speed, lastReport.course
+            ):
+                return  # Same report through another receiver
+        else:
+            self.trackers[mmsi] = self.trackerFactory()
+            # Served as reported until a tick reaches the vessel (never at 0, 0)
+            record = np.zeros(1, dtype=export.binaryRecord)[0]
+            record["timestamp"] = recvTime
+            record["lat"] = msg["lat"]
+            record["lon"] = msg["lon"]
+            record["speed"] = msg["speed"]
+            record["course"] = msg["course"]
+            self.records[mmsi] = record
+            self.order.append(mmsi)
+        self.trackers[mmsi].ingest(report)
+        self.lastReport[mmsi] = (recvTime, report)
+        self.records[mmsi]["mmsi"] = mmsi
+        self.records[mmsi]["heading"] = msg["heading"]
+        self.reports += 1
+
+    def evict(self, now):
+        silent = [
+            mmsi for mmsi, (lastTime, _) in self.lastReport.items()
+            if now - lastTime > self.evictAfter
+        ]
+        for mmsi in silent:
+            del self.trackers[mmsi], self.lastReport[mmsi], self.records[mmsi]
+        if silent:
+            self.order = [mmsi for mmsi in self.order if mmsi in self.trackers]
+            self.evicted += len(silent)
+
+    def tick(self, now):
+        # Positions of all active vessels at `now` >> export.binaryRecord array
+        deadline = time.perf_counter() + self.tickBudget
+        t = now - self.startTime
+        reached = 0
+        for mmsi in self.order:
+            if time.perf_counter() > deadline:
+                self.overruns += 1
+                break
+            state = self.trackers[mmsi].position_at(t)
+            lat, lon = defaultProjection.toLatLon(state.posX, state.posY)
+            record = self.records[mmsi]
+            record["timestamp"] = now
+            record["lat"] = lat
+            record["lon"] = lon
+            record["speed"] = state.speed / knotsToMs
+            record["course"] = rad2course(state.course)
+            reached += 1
+        self.order = self.order[reached:] + self.order[:reached]
+        records = np.array(list(self.records.values()), dtype=export.binaryRecord)
+        return records
+
+
+async def consumeReports(queue, vessels, dayWriter=None):
+    # Capture queue (receive time, sentence, source) >> vessels (and the day file)
+    # Multipart sentences are reassembled per source
+    assemblers = {}
+    while True:
+        recvTime, sentence, source = await queue.get()
+        if dayWriter is not None:
+            dayWriter.write(recvTime, sentence, source)
+        if source not in assemblers:
+            assemblers[source] = nmea.MultipartAssembler()
+        sentences = assemblers[source].push(sentence, recvTime)
+        msg = None
+        if sentences is not None:
+            try:
+                msg = nmea.decodeMessage(*sentences, positionalOnly=True)
+            except Exception:
+                pass  # Corrupt sentence
+        if isValidReport(msg):
+            vessels.ingest(recvTime, msg)
+        queue.task_done()
+
+
+class FrameServer:
+    # Local TCP clients receiving every tick's frame
+
+    def __init__(self, maxClientBuffer=1 << 20):
+        self.maxClientBuffer = maxClientBuffer
+        self.clients = set()
+        self.skipped = 0  # Frames not sent to a slow client
+
+    async def handleClient(self, reader, writer):
+        self.clients.add(writer)
+        try:
+            await reader.read()  # Until the client disconnects
+        except OSError:
+            pass
+        finally:
+            self.clients.discard(writer)
+            writer.close()
+
+    def broadcast(self, frame):
+        for writer in list(self.clients):
+            if writer.is_closing():
+                self.clients.discard(writer)
+            elif writer.transport.get_write_buffer_size() > self.maxClientBuffer:
+                self.skipped += 1
+            else:
+                writer.write(frame)
+
+
+async def serveFrames(vessels, frameServer, renderRate, dayWriter=None):
+    loop = asyncio.get_running_loop()
+    interval = 1 / renderRate
+    nextTick = loop.time()
+    while True:
+        now = vessels.clock.now()
+        vessels.evict(now)
+        records = vessels.tick(now)
+        header = np.array([(liveMagic, now, len(records))], dtype=liveHeader)
+        frameServer.broadcast(header.tobytes() + records.tobytes())
+        if dayWriter is not None:
+            dayWriter.flushIfDue(now)
+        nextTick += interval
+        delay = nextTick - loop.time()
+        if delay < 0:  # Late: skip the missed ticks instead of bursting
+            nextTick = loop.time()
+            delay = 0
+        await asyncio.sleep(delay)
+
+
+async def reportStats(sources, vessels, frameServer, interval):
+    while True:
+        await asyncio.sleep(interval)
+        received = sum(source.records for source in sources)
+        print(
+            f"{len(vessels.trackers)} vessels, {received} sentences, "
+            f"{vessels.reports} reports, {vessels.evicted} evicted, "
+            f"{vessels.overruns} overruns, {len(frameServer.clients)} clients, "
+            f"{frameServer.skipped} skipped frames"
+        )
+
+
+async def runLive(
+    sources, trackerFactory, renderRate=60, host="127.0.0.1", port=10111,
+    dayWriter=None, queueSize=10000, statsInterval=5, **vesselOptions,
+):
+    # Runs until every finite source (replay) is done, live sources run forever
+    vessels = LiveVessels(trackerFactory, **vesselOptions)
+    frameServer = FrameServer()
+    server = await asyncio.start_server(frameServer.handleClient, host, port)
+    queue = asyncio.Queue(maxsize=queueSize)
+    tasks = [
+        asyncio.create_task(consumeReports(queue, vessels, dayWriter)),
+        asyncio.create_task(serveFrames(vessels, frameServer, renderRate, dayWriter)),
+        asyncio.create_task(reportStats(sources, vessels, frameServer, statsInterval)),
+    ]
+    try:
+        await asyncio.gather(*[source.run(queue) for source in sources])
+        await queue.join()
+    finally:
+        for task in tasks:
+            task.cancel()
+        server.close()
+        if dayWriter is not None:
+            dayWriter.close()
+
+
+if __name__ == "__main__":
+    # RUN: python live.py [day file to replay] [speed]  (e.g. data/2022-11-16.csv 10)
+    if len(sys.argv) > 1:
+        speed = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+        sources = [ReplaySource(sys.argv[1], speed=speed)]
+        dayWriter = None
+        vesselOptions = {"clock": sources[0].clock}  # Ticks in replay time
+    else:
+        sources = [
+            SerialSource("COM5", 38400),
+            # TCPSource("192.168.1.10", 10110),
+            # UDPSource("0.0.0.0", 10110),
+        ]
+        dayWriter = DayWriter()  # Keep recording while serving
+        vesselOptions = {}
+    trackerFactory = lambda: AGBTracker(["P2_Quad", 0.5])
+    asyncio.run(runLive(sources, trackerFactory, dayWriter=dayWriter, **vesselOptions))
@@ -1,28 +1,19 @@
 import serial
-from datetime import datetime
-import time
+from capture import DayWriter, splitSentences, receiveClock
 
-c_port = serial.Serial("COM5", 38400)
+# Single receiver logger (see capture.py for several receivers / network feeds)
+# Read whatever the receiver has buffered (at least 1 byte, or timeout)
+c_port = serial.Serial("COM5", 38400, timeout=0.5)
 
-aisMessage = ""  # Buffer message byte by byte
-
-
-def storeAISMessage():
-    global aisMessage
-    aisMessage = aisMessage.strip()
-    dateToday = datetime.now().strftime("%Y-%m-%d")
-    fileName = "data/{}.csv".format(dateToday)
-    csvFile = open(fileName, "a")
-    epochTimeNow = int(time.time())
-    aisRecord = "{} {}".format(epochTimeNow, aisMessage)
-    csvFile.write(aisRecord + "\n")
-    csvFile.close()
-    aisMessage = ""  # Clear buffer
-    print(aisRecord)
+# Persistent day file, flushed every 200 records or 5 seconds
+dayWriter = DayWriter(flushInterval=5, flushRecords=200)
 
+aisBuffer = bytearray()  # Received bytes not yet split into sentences
 
 while True:
-    aisMessageByte = c_port.read()  # Read a single byte
-    aisMessage += aisMessageByte.decode("ascii")
-    if "\r\n" in aisMessage:
-        storeAISMessage()
+    aisBuffer += c_port.read(c_port.in_waiting or 1)
+    now = receiveClock.now()  # ms receive time, monotonic
+    for aisMessage in splitSentences(aisBuffer):
+        aisRecord = dayWriter.write(now, aisMessage)
+        print(aisRecord)
+    dayWriter.flushIfDue(now)
@@ -1,4 +1,9 @@
-import csv
+import os
+import subprocess
+import numpy as np
+from multiprocessing import Pool
+import trajindex
+from PIL import Image
 import cartopy.crs as ccrs
 import cartopy.io.img_tiles as cimgt
 from cartopy.mpl.gridliner import LONGITUDE_FORMATTER, LATITUDE_FORMATTER
@@ -11,20 +16,56 @@ matplotlib.use("agg")
 import matplotlib.pyplot as plt
 
 
-fileName = "2022_11_19-15_10.unreal"
+fileName = "2022_11_19-15_10"  # out/{fileName}.unreal.csv
 startSample = 110
 endSample = 150
 
-AISMessages = []
+# Or select one vessel by time instead of by row (e.g. 0 to 600 seconds)
+vesselMMSI = None
+startTime = 0
+endTime = 600
+
+# Frames are rendered by this many worker processes (1: sequential)
+processes = 1
+# Optional video of the frames (needs ffmpeg on PATH), e.g. "img/track.mp4"
+videoFile = None
+videoFPS = 10
+
+
+def loadMessages():
+    # Seekable index (out/{fileName}.unreal.bin, built from the CSV on first use)
+    trajectoryIndex = trajindex.loadIndex(fileName)
+
+    # Extract a sample from AIS recording
+    if vesselMMSI is None:
+        return trajectoryIndex.getSamples(startSample, endSample)
+    return trajectoryIndex.getVesselWindow(vesselMMSI, startTime, endTime)
+
+
+class CachedTiles(cimgt.GoogleTiles):
+    # Google tiles stored in tiles/{style}/{z}/{x}_{y}.png after the first download
+    # offline=True only uses the cache (missing tiles are left blank)
+
+    def __init__(self, cacheDir="tiles", offline=False, **kwargs):
+        super().__init__(**kwargs)
+        self.cacheDir = cacheDir
+        self.offline = offline
+
+    def get_image(self, tile):
+        x, y, z = tile
+        tileDir = f"{self.cacheDir}/{self.style}/{z}"
+        tilePath = f"{tileDir}/{x}_{y}.png"
+        if os.path.exists(tilePath):
+            img = Image.open(tilePath).convert(self.desired_tile_form)
+            return img, self.tileextent(tile), "lower"
+        if self.offline:
+            img = Image.new(self.desired_tile_form, (256, 256), "white")
+            return img, self.tileextent(tile), "lower"
+        img, extent, origin = super().get_image(tile)
+        os.makedirs(tileDir, exist_ok=True)
+        img.save(tilePath)
+        return img, extent, origin
 
-with open(f"out/{fileName}.csv", "r") as csvFile:
-    reader = csv.DictReader(csvFile)
-    i = 0
-    for line in reader:
-        # Extract a sample from AIS recording
-        if startSample <= i <= endSample:
-            AISMessages.append(line)
-        i += 1
 
 ### Drawing map
 # Colombo Harbor coordinates
@@ -38,61 +79,150 @@ harbor_extent = [
     6.974111,
 ]
 
-# Create a Stamen watercolor background instance or use Google Maps
-# terrain_requestor = cimgt.Stamen("watercolor")
-terrain_requestor = cimgt.GoogleTiles()
-# terrain_requestor = cimgt.GoogleTiles(style="satellite") # Use satellite images
+# Plot origin on the map
+originLat = 6.955879
+originLon = 79.844690
 
-# Define map size and dpi
-fig = plt.figure(figsize=(10, 9), dpi=150)
 
-# Create a GeoAxes in the tile's projection
-ax = plt.axes(projection=ccrs.PlateCarree())
+def createMap(withTiles=True):
+    # Create a Stamen watercolor background instance or use Google Maps
+    # terrain_requestor = cimgt.Stamen("watercolor")
+    terrain_requestor = CachedTiles()
+    # terrain_requestor = CachedTiles(style="satellite") # Use satellite images
+    # terrain_requestor = CachedTiles(offline=True) # Only use tiles/ (no network)
 
-# Limit the extent of the map to a small longitude/latitude range
-ax.set_extent(harbor_extent, crs=ccrs.PlateCarree())
+    # Define map size and dpi
+    fig = plt.figure(figsize=(10, 9), dpi=150)
 
-# Increase quality in Cartopy map
-ax.add_image(terrain_requestor, 15, interpolation="spline36", regrid_shape=2000)
+    # Create a GeoAxes in the tile's projection
+    ax = plt.axes(projection=ccrs.PlateCarree())
 
-# Draw grid-lines on the map (Optional)
-# gl = ax.gridlines(draw_labels=True, alpha=0.3)
-# gl.xlabels_top = gl.ylabels_right = False
-# gl.xformatter = LONGITUDE_FORMATTER
-# gl.yformatter = LATITUDE_FORMATTER
+    # Limit the extent of the map to a small longitude/latitude range
+    ax.set_extent(harbor_extent, crs=ccrs.PlateCarree())
 
-i = 0
-prevAISMessage = ""
+    # Increase quality in Cartopy map
+    if withTiles:
+        ax.add_image(terrain_requestor, 15, interpolation="spline36", regrid_shape=2000)
 
-# Plot origin on the map
-originLat = 6.955879
-originLon = 79.844690
-plt.plot(
-    originLon,
-    originLat,
-    marker="o",
-    markersize=3,
-    markeredgecolor="red",
-    markerfacecolor="green",
-)
-
-
-for AISMessage in AISMessages:
-    i += 1
-    if prevAISMessage == "":
-        prevAISMessage = AISMessage
-        continue
-    plt.plot(
-        [float(prevAISMessage["Longitude"]), float(AISMessage["Longitude"])],
-        [float(prevAISMessage["Latitude"]), float(AISMessage["Latitude"])],
+    # Draw grid-lines on the map (Optional)
+    # gl = ax.gridlines(draw_labels=True, alpha=0.3)
+    # gl.xlabels_top = gl.ylabels_right = False
+    # gl.xformatter = LONGITUDE_FORMATTER
+    # gl.yformatter = LATITUDE_FORMATTER
+
+    ax.plot(
+        originLon,
+        originLat,
+        marker="o",
+        markersize=3,
+        markeredgecolor="red",
+        markerfacecolor="green",
+    )
+
+    # Rasterise the map once, frames only draw their new segments on top
+    fig.canvas.draw()
+    return fig, ax
+
+
+def getCropBox(fig):
+    # Crop of the rendered canvas as savefig(bbox_inches="tight") (pixels, top-left origin)
+    tightBox = fig.get_tightbbox(fig.canvas.get_renderer()).padded(0.1)
+    cropLeft = max(int(tightBox.x0 * fig.dpi), 0)
+    cropRight = int(tightBox.x1 * fig.dpi)
+    cropTop = max(int(fig.bbox.height - tightBox.y1 * fig.dpi), 0)
+    cropBottom = int(fig.bbox.height - tightBox.y0 * fig.dpi)
+    return slice(cropTop, cropBottom), slice(cropLeft, cropRight)
+
+
+def drawSegment(ax, prevAISMessage, AISMessage):
+    (segment,) = ax.plot(
+        [prevAISMessage["lon"], AISMessage["lon"]],
+        [prevAISMessage["lat"], AISMessage["lat"]],
         "ob--",
         markersize=1.5,
         linewidth=0.5,
     )
-    plt.pause(0.01)  # A little tick to force an update on the map
-    plt.savefig(f"img/{i}.png", bbox_inches="tight")
-    print(f"Map Progress: {i}/{endSample - startSample + 1}")
-    prevAISMessage = AISMessage
+    ax.draw_artist(segment)
+
+
+def renderFrames(firstFrame, lastFrame, basemap=None, encode=False):
+    # Frame i shows the track up to the i-th message (i = 2..len(AISMessages))
+    # basemap: canvas of createMap() from the parent, so workers skip the tiles
+    # encode: pipe the frames to ffmpeg (videoFile) instead of img/{i}.png
+    AISMessages = loadMessages()
+    if basemap is None:
+        fig, ax = createMap()
+    else:
+        fig, ax = createMap(withTiles=False)
+        np.asarray(fig.canvas.buffer_rgba())[:] = basemap
+    cropRows, cropColumns = getCropBox(fig)
+    encoder = startEncoder(fig) if encode else None
+
+    # Redraw the polyline prefix before the first frame of this range
+    for i in range(2, firstFrame):
+        drawSegment(ax, AISMessages[i - 2], AISMessages[i - 1])
+
+    for i in range(firstFrame, lastFrame + 1):
+        drawSegment(ax, AISMessages[i - 2], AISMessages[i - 1])
+        frame = np.asarray(fig.canvas.buffer_rgba())[cropRows, cropColumns]
+        if encoder is not None:
+            encoder.stdin.write(np.ascontiguousarray(frame[:, :, :3]).tobytes())
+        else:
+            Image.fromarray(frame).save(f"img/{i}.png")
+        print(f"Map Progress: {i}/{len(AISMessages)}")
+    if encoder is not None:
+        encoder.stdin.close()
+        encoder.wait()
+    plt.close(fig)
+    return lastFrame - firstFrame + 1
+
+
+def startEncoder(fig):
+    # ffmpeg reading raw RGB frames from stdin (frames written without PNGs)
+    cropRows, cropColumns = getCropBox(fig)
+    width = cropColumns.stop - cropColumns.start
+    height = cropRows.stop - cropRows.start
+    return subprocess.Popen(
+        ["ffmpeg", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}",
+         "-r", str(videoFPS), "-i", "-", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+         "-pix_fmt", "yuv420p", videoFile],
+        stdin=subprocess.PIPE,
+    )
+
+
+def encodeFrames(firstFrame):
+    # ffmpeg over the img/{i}.png frames written by the workers
+    subprocess.run(
+        ["ffmpeg", "-y", "-r", str(videoFPS), "-start_number", str(firstFrame),
+         "-i", "img/%d.png", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+         "-pix_fmt", "yuv420p", videoFile],
+        check=True,
+    )
+
+
+def renderMap():
+    frameCount = len(loadMessages())
+    if frameCount < 2:
+        return
+    if processes <= 1:
+        # Encoder sized from the figure renderFrames draws on (basemap drawn once)
+        renderFrames(2, frameCount, encode=videoFile is not None)
+        return
+
+    # Basemap rendered once here, each worker renders a contiguous frame range
+    fig, _ = createMap()
+    basemap = np.array(fig.canvas.buffer_rgba())
+    plt.close(fig)
+    bounds = np.linspace(2, frameCount + 1, processes + 1).astype(int)
+    ranges = [(first, last - 1, basemap) for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+    with Pool(processes) as pool:
+        pool.starmap(renderFrames, ranges)
+    if videoFile is not None:
+        encodeFrames(2)
+
+
+if __name__ == "__main__":
+    renderMap()
 
 # RUN: C:\APPS\python-3.10.0\python.exe map.py
 
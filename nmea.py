@@ -0,0 +1,182 @@
+from collections import OrderedDict
+import numpy as np
+from pyais import decode
+
+# Fast-path decoder for class A position reports (types 1, 2 and 3)
+# The message type sits in the first armored payload character, so anything
+# else is rejected before any bit unpacking. Position reports are unpacked
+# straight from the 6-bit payload (vectorised over a batch), pyais handles the
+# rest.
+# https://gpsd.gitlab.io/gpsd/AIVDM.html#_aivdmaivdo_payload_armoring
+# https://gpsd.gitlab.io/gpsd/AIVDM.html#_types_1_2_and_3_position_report_class_a
+
+positionalTypes = (1, 2, 3)
+positionalBits = 168  # 28 payload characters
+
+# Field name >> (first bit, bit length, signed)
+positionalFields = {
+    "msg_type": (0, 6, False),
+    "mmsi": (8, 30, False),
+    "turn": (42, 8, True),
+    "speed": (50, 10, False),
+    "lon": (61, 28, True),
+    "lat": (89, 27, True),
+    "course": (116, 12, False),
+    "heading": (128, 9, False),
+    "second": (137, 6, False),
+}
+
+
+def getPayload(sentence):
+    # "!AIVDM,1,1,,A,16=q?8hP015eSA03vqtA2wvF0@6E,0*56" >> "16=q?8hP015eSA03vqtA2wvF0@6E"
+    fields = sentence.split(",")
+    if len(fields) < 7:
+        return ""
+    return fields[5]
+
+
+def getPayloadType(payload):
+    # Message type is the 6 bits of the first armored character
+    value = ord(payload[0]) - 48
+    if value > 40:
+        value -= 8
+    return value
+
+
+def isPositional(payload):
+    return len(payload) > 0 and getPayloadType(payload) in positionalTypes
+
+
+def unarmor(payloads):
+    # Batch of payload strings >> (N, 168) array of bits
+    # Short payloads are zero padded, trailing characters beyond 168 bits dropped
+    nChars = positionalBits // 6
+    fixed = b"".join(
+        payload[:nChars].ljust(nChars, "0").encode("ascii", "replace")
+        for payload in payloads
+    )
+    sixBits = np.frombuffer(fixed, dtype=np.uint8).reshape(-1, nChars) - 48
+    sixBits = np.where(sixBits > 40, sixBits - 8, sixBits).astype(np.uint8)
+    shifts = np.arange(5, -1, -1, dtype=np.uint8)
+    bits = (sixBits[:, :, None] >> shifts) & 1
+    return bits.reshape(-1, nChars * 6)
+
+
+def getBitField(bits, start, length, signed=False):
+    weights = np.left_shift(1, np.arange(length - 1, -1, -1, dtype=np.int64))
+    values = bits[:, start : start + length].astype(np.int64) @ weights
+    if signed:
+        values = np.where(values >= 1 << (length - 1), values - (1 << length), values)
+    return values
+
+
+def toTurn(rawTurn):
+    # ROT_AIS = 4.733 * sqrt(ROT) >> degrees per minute, 127/128 are flags
+    turn = np.copysign(np.round((rawTurn / 4.733) ** 2), rawTurn)
+    turn = np.where(np.abs(rawTurn) == 127, rawTurn, turn)
+    return np.where(np.abs(rawTurn) == 128, -128, turn).astype(np.float64)
+
+
+def decodePositionReports(payloads):
+    # Vectorised decode of type 1/2/3 payloads into dict of NumPy columns
+    # Scaling follows pyais: speed/course in 0.1 units, lat/lon in 1/10000 min
+    bits = unarmor(payloads)
+    fields = {}
+    for field, (start, length, signed) in positionalFields.items():
+        fields[field] = getBitField(bits, start, length, signed)
+    return {
+        "msg_type": fields["msg_type"].astype(np.uint8),
+        "mmsi": fields["mmsi"].astype(np.uint32),
+        "turn": toTurn(fields["turn"]),
+        "speed": fields["speed"] / 10.0,
+        "lon": np.round(fields["lon"] / 600000.0, 6),
+        "lat": np.round(fields["lat"] / 600000.0, 6),
+        "course": fields["course"] / 10.0,
+        "heading": fields["heading"].astype(np.uint16),
+        "second": fields["second"].astype(np.uint8),
+    }
+
+
+def decodePositionReport(payload):
+    # Single payload >> message dict, None if it is not a position report
+    if not isPositional(payload):
+        return None
+    columns = decodePositionReports([payload])
+    return {field: values[0].item() for field, values in columns.items()}
+
+
+def decodeMessage(*sentences, positionalOnly=False):
+    # Fast path for single sentence position reports, pyais for everything else
+    # (including position reports split over several sentences)
+    # positionalOnly: reject other message types without decoding them (None),
+    # the type is in the first payload character of the first fragment
+    payload = getPayload(sentences[0])
+    if len(sentences) == 1 and isPositional(payload):
+        return decodePositionReport(payload)
+    if positionalOnly and not isPositional(payload):
+        return None
+    return decode(*sentences).asdict()
+
+
+def getFragmentHeader(sentence):
+    # "!AIVDM,2,1,5,A,..." >> (fragment count, fragment number, sequence ID, channel)
+    fields = sentence.split(",")
+    if len(fields) < 7:
+        return None
+    try:
+        return int(fields[1]), int(fields[2]), fields[3], fields[4]
+    except ValueError:
+        return None
+
+
+class MultipartAssembler:
+    # Reassembles multipart sentences keyed by sequential message ID and channel
+    # Pending groups are dropped after `timeout` seconds (receive time) or when
+    # more than `maxPending` are open (least recently updated first), so a lost
+    # fragment never grows the table.
+    # https://gpsd.gitlab.io/gpsd/AIVDM.html#_aivdmaivdo_sentence_layer
+
+    def __init__(self, timeout=10, maxPending=32):
+        self.timeout = timeout
+        self.maxPending = maxPending
+        self.pending = OrderedDict()  # (seqID, channel) >> [fragments, count, time]
+        self.dropped = 0  # incomplete groups evicted
+
+    def push(self, sentence, recvTime=0):
+        # Returns the complete list of sentences once the last fragment arrives
+        header = getFragmentHeader(sentence)
+        if header is None:
+            return None
+        fragmentCount, fragmentNumber, seqID, channel = header
+        if fragmentCount == 1:
+            return [sentence]
+        if not 1 <= fragmentNumber <= fragmentCount:
+            return None
+        self.evict(recvTime)
+        key = (seqID, channel)
+        group = self.pending.get(key)
+        if group is None or group[1] != fragmentCount or fragmentNumber == 1:
+            # New group (a reused ID means the old group lost a fragment)
+            if group is not None:
+                self.dropped += 1
+            group = [[None] * fragmentCount, fragmentCount, recvTime]
+            self.pending[key] = group
+        group[0][fragmentNumber - 1] = sentence
+        group[2] = recvTime
+        self.pending.move_to_end(key)
+        if None in group[0]:
+            if len(self.pending) > self.maxPending:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            return None
+        del self.pending[key]
+        return group[0]
+
+    def evict(self, recvTime):
+        # Oldest groups are at the front of the table
+        while self.pending:
+            key, group = next(iter(self.pending.items()))
+            if float(recvTime) - float(group[2]) <= self.timeout:
+                break
+            del self.pending[key]
+            self.dropped += 1
@@ -0,0 +1,144 @@
+import sys
+import export, nmea, utils
+from archive import getDayFiles
+
+# Streaming extract >> filter >> export
+# Every stage is a generator, so memory is bounded by the per-vessel sink
+# buffers rather than by the number of messages in the day files:
+#
+#   records = readRecords(getDayFiles("2022-11-15", "2022-11-30"))
+#   messages = decodeMessages(reassemble(records))
+#   sink = VesselSink(export.writeCSVForOctave)
+#   sink.consume(filterMessages(messages, utils.defaultFilter))
+
+
+def readRecords(fileNames):
+    # "1668496136 !AIVDM...." >> (receive time, sentence)
+    for fileName in fileNames:
+        with open(fileName) as csvFile:
+            for line in csvFile:
+                parts = line.split()
+                if len(parts) < 2:
+                    continue
+                yield parts[0], parts[1]
+
+
+def reassemble(records, assembler=None):
+    # (receive time, sentence) >> (receive time, complete list of sentences)
+    if assembler is None:
+        assembler = nmea.MultipartAssembler()
+    for recvTime, sentence in records:
+        sentences = assembler.push(sentence, recvTime)
+        if sentences is not None:
+            yield recvTime, sentences
+
+
+def decodeMessages(groups, positionalOnly=True, batchSize=1024):
+    # (receive time, sentences) >> message dict with "epoch_time"
+    # Position reports are decoded in batches of batchSize (order is kept)
+    batchPayloads = []
+    batchTimes = []
+
+    def flushBatch():
+        if not batchPayloads:
+            return
+        columns = nmea.decodePositionReports(batchPayloads)
+        for i, recvTime in enumerate(batchTimes):
+            msg = {field: values[i].item() for field, values in columns.items()}
+            msg["epoch_time"] = utils.parseEpochTime(recvTime)
+            yield msg
+        batchPayloads.clear()
+        batchTimes.clear()
+
+    for recvTime, sentences in groups:
+        if len(sentences) == 1:
+            payload = nmea.getPayload(sentences[0])
+            if nmea.isPositional(payload):
+                batchPayloads.append(payload)
+                batchTimes.append(recvTime)
+                if len(batchPayloads) >= batchSize:
+                    yield from flushBatch()
+                continue
+        try:
+            # Multi-sentence position reports too (type of the first fragment)
+            msg = nmea.decodeMessage(*sentences, positionalOnly=positionalOnly)
+        except:
+            # Failed: Corrupt sentence.
+            continue
+        if msg is None:
+            continue
+        yield from flushBatch()
+        msg["epoch_time"] = utils.parseEpochTime(recvTime)
+        yield msg
+    yield from flushBatch()
+
+
+def filterMessages(messages, *filterFuncs):
+    # Keep messages that pass every filter (e.g. utils.defaultFilter, customFilter)
+    for msg in messages:
+        if all(filterFunc(msg) for filterFunc in filterFuncs):
+            yield msg
+
+
+class VesselSink:
+    # Buffers messages per MMSI and hands each full buffer to an export writer
+    # writer(msgDictList, fileName, append, startID) e.g. export.writeCSVForOctave
+    # relativeTime: epoch_time counted from the vessel's first report (as extract.py)
+
+    def __init__(self, writer, maxBuffer=256, filePrefix="vessel", relativeTime=True):
+        self.writer = writer
+        self.maxBuffer = maxBuffer
+        self.filePrefix = filePrefix
+        self.relativeTime = relativeTime
+        self.buffers = {}  # MMSI >> pending messages
+        self.startTimes = {}  # MMSI >> first report time
+        self.written = {}  # MMSI >> messages already written
+
+    def push(self, msg):
+        mmsi = msg["mmsi"]
+        if mmsi not in self.buffers:
+            self.buffers[mmsi] = []
+            self.startTimes[mmsi] = msg["epoch_time"]
+            self.written[mmsi] = 0
+        if self.relativeTime:
+            msg["epoch_time"] = msg["epoch_time"] - self.startTimes[mmsi]
+        self.buffers[mmsi].append(msg)
+        if len(self.buffers[mmsi]) >= self.maxBuffer:
+            self.flush(mmsi)
+
+    def flush(self, mmsi):
+        buffer = self.buffers[mmsi]
+        if not buffer:
+            return
+        fileName = f"{self.filePrefix}_{mmsi}"
+        written = self.written[mmsi]
+        self.writer(buffer, fileName, append=written > 0, startID=written)
+        self.written[mmsi] += len(buffer)
+        self.buffers[mmsi] = []
+
+    def close(self):
+        for mmsi in self.buffers:
+            self.flush(mmsi)
+
+    def consume(self, messages):
+        for msg in messages:
+            self.push(msg)
+        self.close()
+        return self.written
+
+
+def runPipeline(fileNames, *filterFuncs, writer=export.writeCSVForOctave):
+    # Raw day files >> per-vessel export files in out/
+    # e.g. runPipeline(files, customFilter, writer=export.writeCSVForUnreal)
+    messages = decodeMessages(reassemble(readRecords(fileNames)))
+    messages = filterMessages(messages, utils.defaultFilter, *filterFuncs)
+    return VesselSink(writer).consume(messages)
+
+
+if __name__ == "__main__":
+    # RUN: python pipeline.py [startDate] [endDate]  (e.g. 2022-11-15 2022-11-30)
+    startDate = sys.argv[1] if len(sys.argv) > 1 else None
+    endDate = sys.argv[2] if len(sys.argv) > 2 else startDate
+    written = runPipeline(getDayFiles(startDate, endDate))
+    for mmsi, count in sorted(written.items()):
+        print(f"vessel_{mmsi}: {count} reports")
@@ -0,0 +1,50 @@
+import numpy as np
+
+# Based on Fossen's equations lat lon to flat (and back)
+# https://github.com/cybergalactic/MSS/blob/master/GNC/llh2flat.m
+# https://github.com/cybergalactic/MSS/blob/master/GNC/flat2llh.m
+# RN/RM are computed once per origin, conversions take scalars or whole arrays.
+
+# Colombo harbor origin
+defaultOriginLat = 6.955879
+defaultOriginLon = 79.844690
+
+a = 6378137  # semi-minor axis (equatorial radius)
+e = 0.0818  # Earth eccentricity (WGS-84)
+
+
+class FlatProjection:
+    def __init__(self, originLat=defaultOriginLat, originLon=defaultOriginLon):
+        self.originLat = originLat
+        self.originLon = originLon
+        # sin() of the origin latitude value as given, identical to the
+        # radii every existing export (utils.computeFlatX/Y) was made with
+        commonDenom = np.sqrt(1 - e**2 * np.sin(originLat) ** 2)
+        self.RN = a / commonDenom
+        self.RM = self.RN * (1 - e**2) / commonDenom
+        # Radians of longitude/latitude per meter
+        self.lonStep = np.arctan2(1, self.RN * np.cos(np.radians(originLat)))
+        self.latStep = np.arctan2(1, self.RM)
+
+    def toFlatX(self, lon):
+        return np.radians(np.asarray(lon, dtype=np.float64) - self.originLon) / self.lonStep
+
+    def toFlatY(self, lat):
+        return np.radians(np.asarray(lat, dtype=np.float64) - self.originLat) / self.latStep
+
+    def toFlat(self, lat, lon):
+        # lat/lon (degrees) >> x (east), y (north) in meters from the origin
+        return self.toFlatX(lon), self.toFlatY(lat)
+
+    def toLon(self, x):
+        return np.degrees(np.asarray(x, dtype=np.float64) * self.lonStep) + self.originLon
+
+    def toLat(self, y):
+        return np.degrees(np.asarray(y, dtype=np.float64) * self.latStep) + self.originLat
+
+    def toLatLon(self, x, y):
+        # x (east), y (north) in meters >> lat/lon (degrees)
+        return self.toLat(y), self.toLon(x)
+
+
+defaultProjection = FlatProjection()
@@ -0,0 +1,111 @@
+import numpy as np
+import utils
+
+# Reporting interval statistics for every vessel at once
+# Works over a utils.buildVesselIndex() index: all rows are time sorted per
+# vessel, so per-vessel results come from np.diff/np.bincount over one array.
+
+trialWindow = (0, 60)  # seconds, intervals counted by the trial rating
+
+vesselStatsFields = [
+    ("mmsi", np.uint32),
+    ("reports", np.int64),
+    ("duration", np.float64),  # first to last report (s)
+    ("rating", np.int64),  # intervals within trialWindow
+    ("mean", np.float64),  # duration / reports (s), extract.py avgReportingInterval
+    ("median", np.float64),
+    ("p90", np.float64),
+]
+
+
+def getVesselIds(vesselIndex):
+    # Vessel number (0..V-1) of every row in index order
+    counts = vesselIndex["end"] - vesselIndex["start"]
+    return np.repeat(np.arange(len(counts)), counts)
+
+
+def getFirstRows(vesselIndex):
+    # True on the first (delta-less) report of each vessel, in index order
+    isFirst = np.zeros(len(vesselIndex["order"]), dtype=bool)
+    isFirst[vesselIndex["start"]] = True
+    return isFirst
+
+
+def getTimeDeltas(vesselIndex, timeArray):
+    # Inter-report deltas in index order, first report of each vessel is 0
+    # (same convention as utils.getTimeDifferenceList on relative times)
+    sortedTime = np.asarray(timeArray)[vesselIndex["order"]].astype(np.float64)
+    deltas = np.diff(sortedTime, prepend=sortedTime[:1])
+    deltas[vesselIndex["start"]] = 0
+    return deltas
+
+
+def getGroupPercentile(values, vesselIds, isFirst, nVessels, q):
+    # Linear-interpolated q-th percentile of each vessel's values (first rows skipped)
+    keep = ~isFirst
+    values = values[keep]
+    vesselIds = vesselIds[keep]
+    order = np.lexsort((values, vesselIds))
+    values = values[order]
+    counts = np.bincount(vesselIds, minlength=nVessels)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    result = np.full(nVessels, np.nan)
+    hasValues = counts > 0
+    pos = (counts[hasValues] - 1) * q / 100
+    lower = np.floor(pos).astype(np.int64)
+    upper = np.minimum(lower + 1, counts[hasValues] - 1)
+    frac = pos - lower
+    base = starts[hasValues]
+    result[hasValues] = (
+        values[base + lower] * (1 - frac) + values[base + upper] * frac
+    )
+    return result
+
+
+def getVesselStats(vesselIndex, timeArray):
+    # Table (structured array) of per-vessel reporting statistics
+    # np.sort(table, order="rating") ranks trial candidates
+    nVessels = len(vesselIndex["vessels"])
+    vesselIds = getVesselIds(vesselIndex)
+    deltas = getTimeDeltas(vesselIndex, timeArray)
+    isFirst = getFirstRows(vesselIndex)
+    counts = vesselIndex["end"] - vesselIndex["start"]
+
+    inWindow = (trialWindow[0] <= deltas) & (deltas <= trialWindow[1])
+    table = np.zeros(nVessels, dtype=vesselStatsFields)
+    table["mmsi"] = vesselIndex["vessels"]
+    table["reports"] = counts
+    table["duration"] = np.bincount(vesselIds, weights=deltas, minlength=nVessels)
+    table["rating"] = np.bincount(vesselIds, weights=inWindow, minlength=nVessels)
+    table["mean"] = table["duration"] / counts
+    table["median"] = getGroupPercentile(deltas, vesselIds, isFirst, nVessels, 50)
+    table["p90"] = getGroupPercentile(deltas, vesselIds, isFirst, nVessels, 90)
+    return table
+
+
+def getIntervalHistogram(vesselIndex, timeArray, bins, maxInterval=None):
+    # Fraction of reporting intervals per bin over all vessels (first rows skipped)
+    deltas = getTimeDeltas(vesselIndex, timeArray)
+    isFirst = getFirstRows(vesselIndex)
+    deltas = deltas[~isFirst]
+    if maxInterval is not None:
+        deltas = deltas[deltas <= maxInterval]
+    counts, edges = np.histogram(deltas, bins=bins)
+    return counts / max(len(deltas), 1), edges
+
+
+def getIntervalPercentiles(vesselIndex, timeArray, q=(50, 90, 99)):
+    # Reporting interval percentiles over all vessels (first rows skipped)
+    deltas = getTimeDeltas(vesselIndex, timeArray)
+    isFirst = getFirstRows(vesselIndex)
+    return np.percentile(deltas[~isFirst], q)
+
+
+def getTrialCandidates(columns, msgTypes=(1, 2, 3)):
+    # Whole archive (archive.loadDays) >> stats table, best rated vessels last
+    rows = np.flatnonzero(np.isin(columns["msg_type"], msgTypes))
+    vesselIndex = utils.buildVesselIndex(
+        columns["mmsi"][rows], columns["epoch_time"][rows]
+    )
+    table = getVesselStats(vesselIndex, columns["epoch_time"][rows])
+    return np.sort(table, order=["rating", "mmsi"])
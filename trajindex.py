@@ -0,0 +1,125 @@
+import os
+import csv
+import numpy as np
+import export
+
+# Seekable index over exported trajectories (map.py / VR replay)
+# Records are kept twice as sorted arrays:
+#   vessel-major (MMSI, time) with block offsets per (MMSI, time bucket)
+#   time-major (time) with block offsets per time bucket
+# "Vessel X between t0 and t1" and "all vessels in a bounding box during
+# minute m" are then a binary search plus one contiguous slice.
+
+defaultBucketSize = 60  # seconds
+
+
+def getBlockKeys(mmsi, timestamps, bucketSize):
+    # (MMSI, time bucket) packed into one sortable int64
+    buckets = np.floor(np.asarray(timestamps) / bucketSize).astype(np.int64)
+    return (np.asarray(mmsi).astype(np.int64) << 32) | (buckets & 0xFFFFFFFF)
+
+
+def getBlockOffsets(keys):
+    # Sorted keys >> unique keys and [start, end) offsets of each block
+    blockKeys, blockStart = np.unique(keys, return_index=True)
+    blockEnd = np.append(blockStart[1:], len(keys))
+    return blockKeys, blockStart, blockEnd
+
+
+class TrajectoryIndex:
+    def __init__(self, records, bucketSize=defaultBucketSize):
+        # records: export.binaryRecord array (e.g. from loadBinaryForUnreal)
+        self.bucketSize = bucketSize
+        vesselOrder = np.lexsort((records["id"], records["timestamp"], records["mmsi"]))
+        if np.all(vesselOrder[1:] > vesselOrder[:-1]):
+            self.vesselRecords = records  # Binary exports are already in order
+        else:
+            self.vesselRecords = records[vesselOrder]
+        # (time, ID): equal times keep the row order of the export (map.py samples)
+        timeOrder = np.lexsort((records["id"], records["timestamp"]))
+        self.timeRecords = records[timeOrder]
+
+        keys = getBlockKeys(
+            self.vesselRecords["mmsi"], self.vesselRecords["timestamp"], bucketSize
+        )
+        self.vesselKeys, self.vesselStart, self.vesselEnd = getBlockOffsets(keys)
+        buckets = np.floor(self.timeRecords["timestamp"] / bucketSize).astype(np.int64)
+        self.timeKeys, self.timeStart, self.timeEnd = getBlockOffsets(buckets)
+
+    def vessels(self):
+        return np.unique(self.vesselKeys >> 32)
+
+    def getVesselWindow(self, mmsi, t0=-np.inf, t1=np.inf):
+        # Records of one vessel with t0 <= timestamp <= t1 (contiguous slice)
+        # Timestamps are epoch or trial-relative seconds, never negative
+        b0 = np.floor(max(t0, 0) / self.bucketSize)
+        b1 = np.floor(min(t1, 2**31 - 1) / self.bucketSize)
+        lo = np.searchsorted(self.vesselKeys, getBlockKeys(mmsi, b0 * self.bucketSize, self.bucketSize))
+        hi = np.searchsorted(self.vesselKeys, getBlockKeys(mmsi, b1 * self.bucketSize, self.bucketSize), "right")
+        if lo >= hi:
+            return self.vesselRecords[0:0]
+        start, end = self.vesselStart[lo], self.vesselEnd[hi - 1]
+        timestamps = self.vesselRecords["timestamp"][start:end]
+        first = start + np.searchsorted(timestamps, t0, "left")
+        last = start + np.searchsorted(timestamps, t1, "right")
+        return self.vesselRecords[first:last]
+
+    def getTimeWindow(self, t0, t1, bounds=None, endInclusive=True):
+        # All records with t0 <= timestamp <= t1 (< t1 if not endInclusive),
+        # optionally inside bounds = [lonMin, lonMax, latMin, latMax] (map.py
+        # harbor_extent layout)
+        lo = np.searchsorted(self.timeKeys, np.floor(t0 / self.bucketSize))
+        hi = np.searchsorted(self.timeKeys, np.floor(t1 / self.bucketSize), "right")
+        if lo >= hi:
+            return self.timeRecords[0:0]
+        start, end = self.timeStart[lo], self.timeEnd[hi - 1]
+        timestamps = self.timeRecords["timestamp"][start:end]
+        first = start + np.searchsorted(timestamps, t0, "left")
+        last = start + np.searchsorted(timestamps, t1, "right" if endInclusive else "left")
+        window = self.timeRecords[first:last]
+        if bounds is not None:
+            lonMin, lonMax, latMin, latMax = bounds
+            inside = (
+                (lonMin <= window["lon"]) & (window["lon"] <= lonMax)
+                & (latMin <= window["lat"]) & (window["lat"] <= latMax)
+            )
+            window = window[inside]
+        return window
+
+    def getMinute(self, minute, bounds=None):
+        # All vessels during minute m (epoch minutes), optionally inside bounds
+        # Half-open [m * 60, m * 60 + 60): a report on the boundary is in the next minute
+        return self.getTimeWindow(minute * 60, minute * 60 + 60, bounds, endInclusive=False)
+
+    def getSamples(self, startSample, endSample):
+        # Rows startSample..endSample (inclusive) in time order
+        return self.timeRecords[startSample : endSample + 1]
+
+
+def readUnrealCSV(fileName):
+    # out/{fileName}.unreal.csv >> export.binaryRecord array (one parse)
+    with open(f"out/{fileName}.unreal.csv", "r") as csvFile:
+        rows = list(csv.DictReader(csvFile))
+    records = np.zeros(len(rows), dtype=export.binaryRecord)
+    records["timestamp"] = [float(row["Timestamp"]) for row in rows]
+    records["mmsi"] = [int(row["MMSI"]) for row in rows]
+    records["lat"] = [float(row["Latitude"]) for row in rows]
+    records["lon"] = [float(row["Longitude"]) for row in rows]
+    records["speed"] = [float(row["Speed"]) for row in rows]
+    records["course"] = [float(row["Course"]) for row in rows]
+    records["heading"] = [int(float(row["Heading"])) for row in rows]
+    records["id"] = [int(row["ID"]) for row in rows]
+    return records
+
+
+def loadIndex(fileName, bucketSize=defaultBucketSize):
+    # Uses (and creates on first use) the binary export next to the CSV
+    # fileName is given without extension, e.g. "2022_11_19-15_10"
+    binPath = f"out/{fileName}.unreal.bin"
+    csvPath = f"out/{fileName}.unreal.csv"
+    if os.path.exists(csvPath) and (
+        not os.path.exists(binPath) or os.path.getmtime(binPath) < os.path.getmtime(csvPath)
+    ):
+        export.writeBinaryRecords(readUnrealCSV(fileName), fileName)
+    _, records = export.loadBinaryForUnreal(fileName)
+    return TrajectoryIndex(records, bucketSize)
@@ -1,4 +1,14 @@
-from math import atan2, radians, sin, cos, sqrt
+import numpy as np
+import projection
+
+
+def parseEpochTime(epochTime):
+    # Receive time: "1668496136" (1 s, int) or "1668496136.123" (ms, float)
+    if isinstance(epochTime, str) and "." not in epochTime:
+        return int(epochTime)
+    if isinstance(epochTime, str):
+        return float(epochTime)
+    return epochTime
 
 
 def defaultFilter(msg):
@@ -22,7 +32,7 @@ def getTimeDifferenceList(msgDictList):
     timeDiffList = []
     for msg in msgDictList:
         prevTime = currTime
-        currTime = int(msg["epoch_time"])
+        currTime = parseEpochTime(msg["epoch_time"])
         delta = currTime - prevTime
         timeDiffList.append(delta)
     return timeDiffList
@@ -36,6 +46,35 @@ def getVesselList(msgDictList):
     return vessels
 
 
+def groupByVessel(msgDictList):
+    # Single pass: MMSI >> list of messages (in their original order)
+    vesselGroups = {}
+    for msg in msgDictList:
+        vesselGroups.setdefault(msg["mmsi"], []).append(msg)
+    return dict(sorted(vesselGroups.items()))
+
+
+def buildVesselIndex(mmsiArray, timeArray):
+    # Sort once by MMSI then time, every vessel is then a contiguous slice
+    # of "order": order[start[i]:end[i]] are the rows of vessels[i]
+    mmsiArray = np.asarray(mmsiArray)
+    order = np.lexsort((np.asarray(timeArray), mmsiArray))
+    vessels, start, count = np.unique(
+        mmsiArray[order], return_index=True, return_counts=True
+    )
+    return {
+        "order": order,
+        "vessels": vessels,
+        "start": start,
+        "end": start + count,
+    }
+
+
+def getVesselRows(vesselIndex, i):
+    # Row indices (time sorted) of the i-th vessel in the index
+    return vesselIndex["order"][vesselIndex["start"][i] : vesselIndex["end"][i]]
+
+
 def printMapBounds(msgDictList):
     minLon = float(min(msgDictList, key=lambda x: x["lon"])["lon"])
     maxLon = float(max(msgDictList, key=lambda x: x["lon"])["lon"])
@@ -44,26 +83,22 @@ def printMapBounds(msgDictList):
     print(f"from ({minLat}, {minLon}) to ({maxLat}, {maxLon})")
 
 
-# Based on Fossen's equations lat lon to flat
-# https://github.com/cybergalactic/MSS/blob/master/GNC/llh2flat.m
+# Based on Fossen's equations lat lon to flat (see projection.py)
+# Scalar helpers on the default (Colombo harbor) origin, use
+# projection.FlatProjection for whole arrays or another origin
 
-originLat = 6.955879
-originLon = 79.844690
-a = 6378137  # semi-minor axis (equatorial radius)
-e = 0.0818  # Earth eccentricity (WGS-84)
-commonDenom = sqrt(1 - e**2 * sin(originLat) ** 2)
-RN = a / commonDenom
-RM = RN * (1 - e**2) / commonDenom
+originLat = projection.defaultOriginLat
+originLon = projection.defaultOriginLon
+RN = projection.defaultProjection.RN
+RM = projection.defaultProjection.RM
 
 
 def computeFlatX(lon):
-    deltaLon = lon - originLon
-    return radians(deltaLon) / atan2(1, RN * cos(radians(originLat)))
+    return float(projection.defaultProjection.toFlatX(lon))
 
 
 def computeFlatY(lat):
-    deltaLat = lat - originLat
-    return radians(deltaLat) / atan2(1, RM)
+    return float(projection.defaultProjection.toFlatY(lat))
 
 
 # Approximate lat lon to X, Y
@@ -465,8 +465,7 @@ def pickInterpType(aisReports, config):
         return P4_Cubic(aisReports)
 
 
-def own_algo(aisData, config):
-    estFreq = 60  # in Hertz
+def own_algo(aisData, config, estFreq=60):
     h = 1 / estFreq
     T = np.arange(0, aisData["duration"], h)
     aX = []
@@ -1,34 +1,40 @@
 import math
 import numpy as np
-from .utils import calcTrajectoryError
+from .utils import getReportFrames
 
 
-def dead_reckoning(aisData):
-    estFreq = 60  # in Hertz
-    T = np.arange(0, aisData["duration"], 1 / estFreq)
-    aX = []
-    aY = []
-    aT = []
-    aE = []
-    aC = []
-    k = 0
-    lSpeed = 0  # latest avail. speed
-    lCourse = 0  # latest avail. course
-    for t in T:
-        if t >= aisData["time"][k]:
-            if k >= len(aisData["time"]) - 1:
-                continue
-            calcTrajectoryError(aE, aX, aY, aisData["x"][k], aisData["y"][k])
-            aX.append(aisData["x"][k])
-            aY.append(aisData["y"][k])
-            aT.append(t)
-            lSpeed = aisData["speed"][k]
-            lCourse = aisData["course"][k]
-            aC.append(lCourse)
-            k += 1
-        else:
-            aX.append(aX[-1] + lSpeed * math.sin(math.radians(lCourse)) * (1 / estFreq))
-            aY.append(aY[-1] + lSpeed * math.cos(math.radians(lCourse)) * (1 / estFreq))
-            aC.append(lCourse)
-            aT.append(t)
-    return [aX, aY, aC, aT, aE]
+def dead_reckoning(aisData, estFreq=60):
+    h = 1 / estFreq
+    T = np.arange(0, aisData["duration"], h)
+    k, reportFrame, lastFrame = getReportFrames(T, aisData["time"])
+    if len(k) == 0:
+        return [np.array([]), np.array([]), np.array([]), np.array([]), np.empty((0, 2))]
+    T = T[reportFrame[0] : lastFrame]
+    reportFrame = reportFrame - reportFrame[0]
+    segmentEnd = np.append(reportFrame[1:], len(T))
+
+    # Constant velocity between reports: report position, then one step per frame
+    aX = np.empty(len(T))
+    aY = np.empty(len(T))
+    aC = np.empty(len(T))
+    for i in range(len(k)):
+        lSpeed = aisData["speed"][k[i]]  # latest avail. speed
+        lCourse = aisData["course"][k[i]]  # latest avail. course
+        start, end = reportFrame[i], segmentEnd[i]
+        aX[start] = aisData["x"][k[i]]
+        aY[start] = aisData["y"][k[i]]
+        aX[start + 1 : end] = lSpeed * math.sin(math.radians(lCourse)) * h
+        aY[start + 1 : end] = lSpeed * math.cos(math.radians(lCourse)) * h
+        np.add.accumulate(aX[start:end], out=aX[start:end])
+        np.add.accumulate(aY[start:end], out=aY[start:end])
+        aC[start:end] = lCourse
+
+    # Trajectory error: position just before each report vs. the report
+    errorFrame = reportFrame[1:] - 1
+    aE = np.column_stack(
+        (
+            np.abs(aX[errorFrame] - np.asarray(aisData["x"])[k[1:]]),
+            np.abs(aY[errorFrame] - np.asarray(aisData["y"])[k[1:]]),
+        )
+    )
+    return [aX, aY, aC, T, aE]
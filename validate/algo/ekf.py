@@ -1,95 +1,230 @@
 import math
-import copy
 import numpy as np
 from .utils import computeFossenChi, wrapToPi, fixCourse, rad2course
-from .utils import calcTrajectoryError
+from .utils import getReportFrames, getErrors, propagateCovariance
 
+# EKF with X = [x y U chi], fixed-size ndarray buffers updated in place.
+# U and chi only change at measurements (f_hat has no U/chi terms), so between
+# two reports the prediction is a straight line, filled for all its frames at
+# once, and PHI is constant: only the covariance is stepped per frame.
+# extended_kalman_fleet runs N vessels at once: states (N, 4) and covariances
+# (N, 4, 4) are stepped together, the corrector runs for the vessels with a
+# report at that frame.
+# eventCovariance: P is only read by the corrector, so it is propagated in one
+# step from each report to the next (utils.propagateCovariance) instead of per
+# frame. PHI is constant between reports and I + h A with A @ A = 0, so this
+# is exact: same results as per frame within rounding (< 1e-8 m).
 
-def extended_kalman(aisData):
-    # First make a copy of AIS data since we are modifying it
-    aisData = copy.deepcopy(aisData)
-    estFreq = 50  # in Hertz
+
+def predictSegment(aX, aY, aC, X_hat, start, end, h):
+    # Predictions X_prd of frames start+1..end from X_hat at frame start
+    if end <= start:
+        return
+    U, chi = X_hat[2], X_hat[3]
+    for aOut, x, dx in ((aX, X_hat[0], U * math.cos(chi)), (aY, X_hat[1], U * math.sin(chi))):
+        kept = aOut[start]  # Output of frame start (its own X_prd)
+        aOut[start] = x
+        aOut[start + 1 : end + 1] = h * dx
+        np.add.accumulate(aOut[start : end + 1], out=aOut[start : end + 1])
+        aOut[start] = kept
+    aC[start + 1 : end + 1] = rad2course(math.pi / 2 - chi)
+
+
+def fillTrack(T, X_init, updates, h):
+    # Frame outputs of one vessel from its initial state and (frame, X_hat) updates
+    aX = np.empty(len(T))
+    aY = np.empty(len(T))
+    aC = np.empty(len(T))
+    aX[0], aY[0] = X_init[0], X_init[1]
+    aC[0] = rad2course(math.pi / 2 - X_init[3])
+    starts = [(0, X_init)] + [update for update in updates if update[0] > 0]
+    if updates and updates[0][0] == 0:
+        starts[0] = updates[0]
+    ends = [start[0] for start in starts[1:]] + [len(T) - 1]
+    for (frame, X_hat), end in zip(starts, ends):
+        predictSegment(aX, aY, aC, X_hat, frame, end, h)
+    return aX, aY, aC
+
+
+def extended_kalman(aisData, estFreq=50, eventCovariance=False):
     h = 1 / estFreq
     T = np.arange(0, aisData["duration"], h)
-    aX = []
-    aY = []
-    aT = []
+    chi_k = computeFossenChi(aisData)  # in Radians
+    # chi_k = fixCourse(aisData)  # in Radians
+    k, reportFrame, lastFrame = getReportFrames(T, aisData["time"])
+    T = T[:lastFrame]
+    aX = np.empty(len(T))
+    aY = np.empty(len(T))
+    aC = np.empty(len(T))
     aE = []
-    aC = []
-    k = 0
-    aisData["course"] = computeFossenChi(aisData)  # in Radians
-    # aisData["course"] = fixCourse(aisData)  # in Radians
+    if len(T) == 0:
+        return [aX, aY, aC, T, np.empty((0, 2))]
+
     # Initialization of EKF: X = [x y U chi]
     Q = np.diag([0.01, 0.01, 0.1, 0.1])
     R = np.diag([0.001, 0.001, 0.001, 0.01])
-    X_prd = np.matrix(
-        [aisData["x"][0], aisData["y"][0], aisData["speed"][0], aisData["course"][0]]
-    ).T
-    P_prd = 0.1 * np.eye(4)
-
-    for t in T:
-
-        # Corrector with K=0 (no update)
-        X_hat = X_prd
-        P_hat = P_prd
-
-        # Measurements
-        if t >= aisData["time"][k]:
-            if k >= len(aisData["time"]) - 1:
-                continue
-            calcTrajectoryError(aE, aX, aY, aisData["x"][k], aisData["y"][k])
-            x_k = aisData["x"][k]
-            y_k = aisData["y"][k]
-            U_k = aisData["speed"][k]
-            chi_k = aisData["course"][k]
-
-            z_k = np.matrix([x_k, y_k, U_k, chi_k]).T
-            eps = z_k - X_prd
-            eps.itemset(3, wrapToPi(eps.item(3)))
-
-            # Corrector
-            K = P_prd * np.matrix(P_prd + R, dtype="float").I
-
-            X_hat = X_prd + K * eps
-            P_hat = (np.eye(4) - K) * P_prd * (np.eye(4) - K).T + K * R * K.T
-
-            k += 1
-
-        # Store simulation data: only x & y for plotting
-        aX.append(X_prd.item(0))
-        aY.append(X_prd.item(1))
-        aC.append(rad2course(math.pi / 2 - X_prd.item(3)))
-        aT.append(t)
-
-        # Predictor (k+1)
-        f_hat = np.matrix(
-            [
-                X_hat.item(2) * math.cos(X_hat.item(3)),
-                X_hat.item(2) * math.sin(X_hat.item(3)),
-                0,
-                0,
-            ]
-        ).T
-        A = np.matrix(
-            [
-                [
-                    0,
-                    0,
-                    math.cos(X_hat.item(3)),
-                    -X_hat.item(2) * math.sin(X_hat.item(3)),
-                ],
-                [
-                    0,
-                    0,
-                    math.sin(X_hat.item(3)),
-                    X_hat.item(2) * math.cos(X_hat.item(3)),
-                ],
-                [0, 0, 0, 0],
-                [0, 0, 0, 0],
-            ]
-        )
-        PHI = np.eye(4) + A * h
-        X_prd = X_hat + h * f_hat
-        P_prd = PHI * P_hat * PHI.T + Q
-
-    return [aX, aY, aC, aT, aE]
+    X_hat = np.array([aisData["x"][0], aisData["y"][0], aisData["speed"][0], chi_k[0]])
+    P = 0.1 * np.eye(4)  # P_prd of the current frame, then P_hat
+    I = np.eye(4)
+    PHI = np.eye(4)
+    F = np.zeros((4, 4))
+    PR = np.empty((4, 4))
+    K = np.empty((4, 4))
+    IK = np.empty((4, 4))
+    tmp = np.empty((4, 4))
+    z_k = np.empty(4)
+    eps = np.empty(4)
+
+    # Frame 0 is the initial X_prd, frames up to the first report follow from it
+    aX[0], aY[0] = X_hat[0], X_hat[1]
+    aC[0] = rad2course(math.pi / 2 - X_hat[3])
+    frame = 0  # Frame of X_hat / P
+    nextFrames = np.append(reportFrame, len(T) - 1)
+    for i in range(len(k) + 1):
+        # Predictor up to the next report (or the end)
+        nextFrame = nextFrames[i]
+        predictSegment(aX, aY, aC, X_hat, frame, nextFrame, h)
+        if i == len(k):
+            break
+        if nextFrame > frame:
+            U, chi = X_hat[2], X_hat[3]
+            if eventCovariance:
+                F[0, 2] = math.cos(chi)
+                F[0, 3] = -U * math.sin(chi)
+                F[1, 2] = math.sin(chi)
+                F[1, 3] = U * math.cos(chi)
+                P = propagateCovariance(P, F, Q, nextFrame - frame, h)
+            else:
+                PHI[0, 2] = math.cos(chi) * h
+                PHI[0, 3] = -U * math.sin(chi) * h
+                PHI[1, 2] = math.sin(chi) * h
+                PHI[1, 3] = U * math.cos(chi) * h
+                for _ in range(nextFrame - frame):
+                    np.matmul(PHI, P, out=tmp)
+                    np.matmul(tmp, PHI.T, out=P)
+                    P += Q
+            X_hat[0], X_hat[1] = aX[nextFrame], aY[nextFrame]
+        frame = nextFrame
+
+        # Corrector at the report frame
+        if frame > 0:
+            aE.append([abs(aX[frame - 1] - aisData["x"][k[i]]), abs(aY[frame - 1] - aisData["y"][k[i]])])
+        z_k[:] = aisData["x"][k[i]], aisData["y"][k[i]], aisData["speed"][k[i]], chi_k[k[i]]
+        np.subtract(z_k, X_hat, out=eps)
+        eps[3] = wrapToPi(eps[3])
+        # K = P (P + R)^-1, solved instead of inverted
+        np.add(P, R, out=PR)
+        K[:] = np.linalg.solve(PR.T, P.T).T
+        X_hat += K @ eps
+        np.subtract(I, K, out=IK)
+        np.matmul(IK, P, out=tmp)
+        np.matmul(tmp, IK.T, out=P)
+        np.matmul(K, R, out=tmp)
+        P += tmp @ K.T
+
+    return [aX, aY, aC, T, np.array(aE).reshape(-1, 2)]
+
+
+def extended_kalman_fleet(aisDataList, estFreq=50, eventCovariance=False):
+    # extended_kalman for every aisData of the list >> list of [aX, aY, aC, aT, aE]
+    h = 1 / estFreq
+    Q = np.diag([0.01, 0.01, 0.1, 0.1])
+    R = np.diag([0.001, 0.001, 0.001, 0.01])
+    vessels = []
+    for aisData in aisDataList:
+        T = np.arange(0, aisData["duration"], h)
+        chi_k = computeFossenChi(aisData)  # in Radians
+        k, reportFrame, lastFrame = getReportFrames(T, aisData["time"])
+        Z = np.column_stack((aisData["x"], aisData["y"], aisData["speed"], chi_k))
+        vessels.append((T[:lastFrame], k, reportFrame, Z))
+
+    # Vessels ordered by their last report, so the ones still to be corrected
+    # are always the first nActive rows (stepped as views, no copies)
+    lastReport = [reportFrame[-1] if len(k) else -1 for T, k, reportFrame, Z in vessels]
+    order = np.argsort(lastReport, kind="stable")[::-1]
+    N = len(order)
+    X = np.array([vessels[i][3][0] for i in order]).reshape(N, 4)  # X_prd, then X_hat
+    X_init = X.copy()
+    updates = [[] for _ in range(N)]  # (frame, X_hat) per row
+
+    # Reports grouped by frame: (frame, row, report index)
+    eventFrame = np.concatenate([vessels[i][2] for i in order] + [[]]).astype(np.int64)
+    eventRow = np.concatenate([np.full(len(vessels[i][1]), row) for row, i in enumerate(order)] + [[]])
+    eventReport = np.concatenate([vessels[i][1] for i in order] + [[]]).astype(np.int64)
+    eventOrder = np.argsort(eventFrame, kind="stable")
+    eventFrame = eventFrame[eventOrder]
+    eventRow = eventRow[eventOrder].astype(np.int64)
+    eventReport = eventReport[eventOrder]
+    frames, groupStart = np.unique(eventFrame, return_index=True)
+    groupEnd = np.append(groupStart[1:], len(eventFrame))
+    rowLast = np.array([lastReport[i] for i in order])
+
+    P = np.tile(0.1 * np.eye(4), (N, 1, 1))
+    PHI = np.tile(np.eye(4), (N, 1, 1))
+    PHIT = np.tile(np.eye(4), (N, 1, 1))
+    F = np.zeros((N, 4, 4))  # PHI = I + h F
+    step = np.zeros((N, 2))  # h * f_hat (x, y) of the current segment
+    tmp = np.empty((N, 4, 4))
+    stateFrame = np.zeros(N, dtype=np.int64)  # Frame of X and P (eventCovariance)
+
+    def setSegment(S):
+        U, chi = X[S, 2], X[S, 3]
+        step[S, 0] = h * (U * np.cos(chi))
+        step[S, 1] = h * (U * np.sin(chi))
+        F[S, 0, 2] = np.cos(chi)
+        F[S, 0, 3] = -U * np.sin(chi)
+        F[S, 1, 2] = np.sin(chi)
+        F[S, 1, 3] = U * np.cos(chi)
+        PHI[S, 0, 2] = np.cos(chi) * h
+        PHI[S, 0, 3] = -U * np.sin(chi) * h
+        PHI[S, 1, 2] = np.sin(chi) * h
+        PHI[S, 1, 3] = U * np.cos(chi) * h
+        PHIT[S] = PHI[S].transpose(0, 2, 1)
+
+    setSegment(np.arange(N))
+    frame = 0
+    nActive = int(np.sum(rowLast >= 0))
+    for nextFrame, start, end in zip(frames, groupStart, groupEnd):
+        # Predictor for all active vessels up to the next frame with a report
+        n = nActive
+        if not eventCovariance:
+            for _ in range(nextFrame - frame):
+                X[:n, :2] += step[:n]
+                np.matmul(PHI[:n], P[:n], out=tmp[:n])
+                np.matmul(tmp[:n], PHIT[:n], out=P[:n])
+                P[:n] += Q
+        frame = nextFrame
+
+        # Corrector for the vessels with a report at this frame
+        S = eventRow[start:end]
+        if eventCovariance:
+            # Predictor of these vessels only, from their previous report
+            m = frame - stateFrame[S]
+            X[S, :2] += m[:, None] * step[S]
+            P[S] = propagateCovariance(P[S], F[S], Q, m, h)
+            stateFrame[S] = frame
+        z_k = np.array([vessels[order[row]][3][k] for row, k in zip(S, eventReport[start:end])])
+        eps = z_k - X[S]
+        eps[:, 3] = wrapToPi(eps[:, 3])
+        P_S = P[S]
+        # K = P (P + R)^-1, solved instead of inverted
+        K = np.linalg.solve((P_S + R).transpose(0, 2, 1), P_S.transpose(0, 2, 1))
+        K = K.transpose(0, 2, 1)
+        X[S] += np.einsum("nij,nj->ni", K, eps)
+        IK = np.eye(4) - K
+        P[S] = IK @ P_S @ IK.transpose(0, 2, 1) + K @ R @ K.transpose(0, 2, 1)
+        setSegment(S)
+        for row in S:
+            updates[row].append((frame, X[row].copy()))
+        while nActive > 0 and rowLast[nActive - 1] <= frame:
+            nActive -= 1
+
+    tracks = [None] * N
+    for row, i in enumerate(order):
+        T, k, reportFrame, Z = vessels[i]
+        if len(T) == 0:
+            tracks[i] = [T, T, T, T, np.empty((0, 2))]
+            continue
+        aX, aY, aC = fillTrack(T, X_init[row], updates[row], h)
+        tracks[i] = [aX, aY, aC, T, getErrors(aX, aY, aisDataList[i], k, reportFrame)]
+    return tracks
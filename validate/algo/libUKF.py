@@ -1,5 +1,7 @@
+import math
 import numpy as np
 import scipy.linalg
+from contextlib import nullcontext
 from copy import deepcopy
 from threading import Lock
 
@@ -8,6 +10,54 @@ class UKFException(Exception):
     """Raise for errors in the UKF, usually due to bad inputs"""
 
 
+def cholesky(mat):
+    """lower Cholesky factor of mat, with growing jitter on the diagonal if mat is near-singular"""
+    try:
+        return np.linalg.cholesky(mat)
+    except np.linalg.LinAlgError:
+        pass
+    scale = max(np.trace(mat) / len(mat), np.finfo(float).tiny)
+    for jitter in (1e-12, 1e-10, 1e-8, 1e-6):
+        try:
+            return np.linalg.cholesky(mat + jitter * scale * np.eye(len(mat)))
+        except np.linalg.LinAlgError:
+            pass
+    raise UKFException("covariance is not positive definite")
+
+
+def cholupdate(lower, vecs, sign=1):
+    """
+    rank one updates (sign 1) or downdates (sign -1) of a lower Cholesky factor,
+    one per column of vecs (or a single vector): the factor of
+    lower @ lower.T + sign * vecs @ vecs.T, without refactorising.
+    Plain floats: for the small state sizes here numpy calls would dominate
+    """
+    lower = np.asarray(lower, dtype=float)
+    n = len(lower)
+    rows = lower.tolist()
+    for vec in np.asarray(vecs, dtype=float).reshape(n, -1).T.tolist():
+        for k in range(n):
+            row_k = rows[k]
+            r2 = row_k[k] * row_k[k] + sign * vec[k] * vec[k]
+            if r2 <= 0:
+                raise UKFException("downdate makes the covariance indefinite")
+            r = math.sqrt(r2)
+            c = r / row_k[k]
+            s = vec[k] / row_k[k]
+            row_k[k] = r
+            for i in range(k + 1, n):
+                row_i = rows[i]
+                row_i[k] = (row_i[k] + sign * s * vec[i]) / c
+                vec[i] = c * vec[i] - s * row_i[k]
+    return np.array(rows)
+
+
+def qr_factor(mat):
+    """lower triangular factor L (positive diagonal) with L @ L.T = mat @ mat.T"""
+    r = np.linalg.qr(mat.T, mode="r")
+    return (r * np.where(np.diag(r) < 0, -1.0, 1.0)[:, None]).T
+
+
 class UKF:
     def __init__(
         self,
@@ -19,6 +69,7 @@ class UKF:
         k,
         beta,
         iterate_function,
+        lock=True,
     ):
         """
         Initializes the unscented kalman filter
@@ -32,6 +83,7 @@ class UKF:
         :param iterate_function: function that predicts the next state
                     takes in a num_states x 1 state and a float timestep
                     returns a num_states x 1 state
+        :param lock: bool, False to skip the lock when the filter is only used from one thread
         """
         self.n_dim = int(num_states)
         self.n_sig = 1 + num_states * 2
@@ -61,23 +113,13 @@ class UKF:
 
         self.sigmas = self.__get_sigmas()
 
-        self.lock = Lock()
+        self.lock = Lock() if lock else nullcontext()
 
     def __get_sigmas(self):
-        """generates sigma points"""
-        ret = np.zeros((self.n_dim, self.n_sig))
-
-        tmp_mat = (self.n_dim + self.lambd) * self.p
-        spr_mat = scipy.linalg.sqrtm(tmp_mat)
-
-        ret[:, 0:1] = self.x
-        for i in range(self.n_dim):
-            ret[:, i + 1: i + 2] = self.x + spr_mat[:, i: i + 1]
-            ret[:, i + 1 + self.n_dim: i + 2 + self.n_dim] = (
-                self.x - spr_mat[:, i: i + 1]
-            )
-
-        return ret
+        """generates sigma points: the state, then the state -/+ the columns of a Cholesky factor of (n + lambda) P"""
+        spr_mat = cholesky((self.n_dim + self.lambd) * self.p)
+        x = np.asarray(self.x)
+        return np.hstack((x, x + spr_mat, x - spr_mat))
 
     def update(self, y_actual, r_matrix):
         """
@@ -86,69 +128,45 @@ class UKF:
         :param data: list of the data corresponding to the values in states
         :param r_matrix: error matrix for the data, again corresponding to the values in states
         """
-        self.lock.acquire()
-
-        num_states = len(self.states)
-
-        # create y, sigmas of just the states that are being updated
-        y = self.states @ self.sigmas
-        # create y_mean, the mean of just the states that are being updated
-        y_mean = self.states @ self.x
-        # differences in y from y mean
-        y_diff = y - y_mean
-        x_diff = self.sigmas - self.x
-        # covariance of measurement
-        p_yy = np.zeros((num_states, num_states))
-        for i, val in enumerate(np.array_split(y_diff, self.n_sig, 1)):
-            p_yy += self.covar_weights[i] * val @ val.T
-        # add measurement noise
-        p_yy += r_matrix
-
-        # covariance of measurement with states
-        p_xy = np.zeros((self.n_dim, num_states))
-        for i, val in enumerate(
-            zip(
-                np.array_split(y_diff, self.n_sig, 1),
-                np.array_split(x_diff, self.n_sig, 1),
-            )
-        ):
-            p_xy += self.covar_weights[i] * val[1] @ val[0].T
-
-        k = p_xy @ np.linalg.inv(p_yy)
-        self.x += k @ (y_actual - y_mean)
-        self.p -= k @ (p_yy @ k.T)
-        self.sigmas = self.__get_sigmas()
-
-        self.lock.release()
+        with self.lock:
+            # create y, sigmas of just the states that are being updated
+            y = self.states @ self.sigmas
+            # create y_mean, the mean of just the states that are being updated
+            y_mean = self.states @ self.x
+            # differences in y from y mean
+            y_diff = y - y_mean
+            x_diff = self.sigmas - self.x
+            # covariance of measurement, with measurement noise
+            weighted_y_diff = y_diff * self.covar_weights
+            p_yy = weighted_y_diff @ y_diff.T + r_matrix
+            # covariance of measurement with states
+            p_xy = x_diff @ weighted_y_diff.T
+
+            # k = p_xy p_yy^-1, solved instead of inverted (p_yy is symmetric)
+            k = np.linalg.solve(p_yy, p_xy.T).T
+            self.x += k @ (y_actual - y_mean)
+            self.p -= k @ (p_yy @ k.T)
+            self.sigmas = self.__get_sigmas()
 
     def predict(self, timestep):
         """
         performs a prediction step
         :param timestep: float, amount of time since last prediction
         """
+        with self.lock:
+            sigmas_out = self.iterate(self.sigmas, timestep)
+            x_out = sigmas_out @ self.mean_weights.reshape(-1, 1)
 
-        self.lock.acquire()
-
-        sigmas_out = self.iterate(self.sigmas, timestep)
-        x_out = sigmas_out @ self.mean_weights.reshape(-1, 1)
-
-        p_out = np.zeros((self.n_dim, self.n_dim))
-        # for each sigma point
-        for i in range(self.n_sig):
-            # take the distance from the mean
-            # make it a covariance by multiplying by the transpose
-            # weight it using the calculated weighting factor
-            # and sum
-            diff = sigmas_out[:, i: i + 1] - x_out
-            p_out += self.covar_weights[i] * (diff @ diff.T)
-        # add process noise
-        p_out += timestep * self.q
-
-        self.sigmas = sigmas_out
-        self.x = x_out
-        self.p = p_out
+            # distances of the sigma points from the mean, made a covariance
+            # by multiplying by the transpose, weighted by the weighting factors
+            diff = sigmas_out - x_out
+            p_out = (diff * self.covar_weights) @ diff.T
+            # add process noise
+            p_out += timestep * self.q
 
-        self.lock.release()
+            self.sigmas = sigmas_out
+            self.x = x_out
+            self.p = p_out
 
     def get_state(self, index=-1):
         """
@@ -191,4 +209,94 @@ class UKF:
             self.p = covar
 
     def modStates(self, states):
-        self.states = np.array(states)
+        self.states = np.array(states, dtype=float)
+
+
+class SquareRootUKF(UKF):
+    """
+    Square-root UKF: same API as UKF, but keeps the lower Cholesky factor s of
+    the covariance (p = s @ s.T) and propagates it with QR and rank one
+    updates instead of refactorising p, so the covariance stays symmetric and
+    positive definite over long runs
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.s = cholesky(self.p)
+        del self.p  # kept as s only, see get_covar
+        # factor of the process noise (positive semi-definite: zero rows allowed)
+        w, v = np.linalg.eigh(self.q)
+        self.sqrt_q = v * np.sqrt(np.maximum(w, 0))
+
+    def __get_sigmas(self):
+        """generates sigma points from the factor: the state -/+ sqrt(n + lambda) times its columns"""
+        spr_mat = math.sqrt(self.n_dim + self.lambd) * self.s
+        x = np.asarray(self.x)
+        return np.hstack((x, x + spr_mat, x - spr_mat))
+
+    def __factor(self, diff, noise_factor):
+        """factor of sum(covar_weights * diff @ diff.T) + noise_factor @ noise_factor.T"""
+        lower = qr_factor(
+            np.hstack((math.sqrt(self.covar_weights[1]) * diff[:, 1:], noise_factor))
+        )
+        # covar_weights[0] is usually negative: downdate
+        w0 = self.covar_weights[0]
+        return self.__downdate(lower, math.sqrt(abs(w0)) * diff[:, 0], 1 if w0 >= 0 else -1)
+
+    def __downdate(self, lower, vecs, sign):
+        """cholupdate, refactorising with jitter (as UKF) if a downdate would lose definiteness"""
+        try:
+            return cholupdate(lower, vecs, sign)
+        except UKFException:
+            vecs = np.asarray(vecs).reshape(len(lower), -1)
+            return cholesky(lower @ lower.T + sign * vecs @ vecs.T)
+
+    def update(self, y_actual, r_matrix):
+        """
+        performs a measurement update
+        :param y_actual: the measured values of the states selected with modStates
+        :param r_matrix: error matrix for the data, again corresponding to the values in states
+        """
+        with self.lock:
+            y = self.states @ self.sigmas
+            y_mean = self.states @ self.x
+            y_diff = y - y_mean
+            x_diff = self.sigmas - self.x
+            s_yy = self.__factor(y_diff, np.linalg.cholesky(r_matrix))
+            p_xy = (x_diff * self.covar_weights) @ y_diff.T
+
+            # k = p_xy (s_yy s_yy^T)^-1
+            k = scipy.linalg.cho_solve((s_yy, True), p_xy.T).T
+            self.x = self.x + k @ (y_actual - y_mean)
+            # p -= k p_yy k^T = (k s_yy) (k s_yy)^T: one downdate per column
+            self.s = self.__downdate(self.s, k @ s_yy, -1)
+            self.sigmas = self.__get_sigmas()
+
+    def predict(self, timestep):
+        """
+        performs a prediction step
+        :param timestep: float, amount of time since last prediction
+        """
+        with self.lock:
+            sigmas_out = self.iterate(self.sigmas, timestep)
+            x_out = sigmas_out @ self.mean_weights.reshape(-1, 1)
+            self.s = self.__factor(sigmas_out - x_out, math.sqrt(timestep) * self.sqrt_q)
+            self.sigmas = sigmas_out
+            self.x = x_out
+
+    def get_covar(self):
+        """
+        :return: current state covariance (n_dim x n_dim)
+        """
+        return self.s @ self.s.T
+
+    def reset(self, state, covar):
+        """
+        Restarts the UKF at the given state and covariance
+        :param state: n_dim x 1
+        :param covar: n_dim x n_dim
+        """
+
+        with self.lock:
+            self.x = state
+            self.s = cholesky(covar)
@@ -3,8 +3,7 @@ import numpy as np
 from .utils import calcTrajectoryError, rad2course
 
 
-def projective_velocity_blending(aisData):
-    estFreq = 60  # in Hertz
+def projective_velocity_blending(aisData, estFreq=60):
     h = 1 / estFreq
     T = np.arange(0, aisData["duration"], h)
     aX = []
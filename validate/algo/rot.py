@@ -1,56 +1,51 @@
-import math
 import numpy as np
-from .utils import calcTrajectoryError
+from .utils import getReportFrames
 
 
-def rate_turn(aisData):
-    estFreq = 60  # in Hertz
+def rate_turn(aisData, estFreq=60):
     h = 1 / estFreq
     T = np.arange(0, aisData["duration"], h)
-    aX = []
-    aY = []
-    aT = []
-    aE = []
-    aC = []
-    k = 0
-    lSpeed = 0  # last known avail. speed
-    lCourse = 0  # last known avail. course
-    lRateOfTurn = 0
-    tSinceL = 0  # time since last known
-    firstAIS = True
-    for t in T:
-        if t >= aisData["time"][k]:
-            if k >= len(aisData["time"]) - 1:
-                continue
-            calcTrajectoryError(aE, aX, aY, aisData["x"][k], aisData["y"][k])
-            tDelta = tSinceL
-            tSinceL = 0
-            pCourse = lCourse  # Previous course
-            aX.append(aisData["x"][k])
-            aY.append(aisData["y"][k])
-            aT.append(t)
-            # print(aisData["x"][k], aisData["y"][k])
-            lSpeed = aisData["speed"][k]
-            lCourse = aisData["course"][k]
-            aC.append(lCourse)
-            if not firstAIS:
-                try:
-                    lRateOfTurn = (lCourse - pCourse) / tDelta
-                except:
-                    lRateOfTurn = 0
-            if firstAIS:
-                firstAIS = False
-            k += 1
-        # print(tSinceL)
-        aX.append(
-            aX[-1]
-            + lSpeed * math.sin(math.radians(lCourse + lRateOfTurn * tSinceL)) * h
-        )
-        aY.append(
-            aY[-1]
-            + lSpeed * math.cos(math.radians(lCourse + lRateOfTurn * tSinceL)) * h
-        )
-        aT.append(t)
-        aC.append(lCourse + lRateOfTurn * tSinceL)
-        tSinceL += h
-    return [aX, aY, aC, aT, aE]
+    k, reportFrame, lastFrame = getReportFrames(T, aisData["time"])
+    if len(k) == 0:
+        return [np.array([]), np.array([]), np.array([]), np.array([]), np.empty((0, 2))]
+    T = T[reportFrame[0] : lastFrame]
+    reportFrame = reportFrame - reportFrame[0]
+    segmentEnd = np.append(reportFrame[1:], len(T))
+
+    aisX = np.asarray(aisData["x"], dtype=np.float64)[k]
+    aisY = np.asarray(aisData["y"], dtype=np.float64)[k]
+    lSpeed = np.asarray(aisData["speed"], dtype=np.float64)[k]
+    lCourse = np.asarray(aisData["course"], dtype=np.float64)[k]
+    # Rate of turn from the previous report (deg/s), none before the second one
+    lRateOfTurn = np.zeros(len(k))
+    lRateOfTurn[1:] = np.diff(lCourse) / (np.diff(reportFrame) * h)
+
+    # Segment of every frame and time since its report
+    segment = np.repeat(np.arange(len(k)), segmentEnd - reportFrame)
+    tSinceL = (np.arange(len(T)) - reportFrame[segment]) * h
+
+    # Constant speed and turn rate: circular arc from the report position
+    # x = x0 + v/w (cos(c0) - cos(c0 + w t)), y = y0 + v/w (sin(c0 + w t) - sin(c0))
+    c0 = np.radians(lCourse)
+    w = np.radians(lRateOfTurn)
+    turning = np.abs(w) > 1e-9  # rad/s, below that the arc is a straight line
+    radius = lSpeed / np.where(turning, w, 1)
+    c = c0[segment] + w[segment] * tSinceL
+    aX = np.where(
+        turning[segment],
+        (aisX + radius * np.cos(c0))[segment] - radius[segment] * np.cos(c),
+        aisX[segment] + (lSpeed * np.sin(c0))[segment] * tSinceL,
+    )
+    aY = np.where(
+        turning[segment],
+        (aisY - radius * np.sin(c0))[segment] + radius[segment] * np.sin(c),
+        aisY[segment] + (lSpeed * np.cos(c0))[segment] * tSinceL,
+    )
+    aC = lCourse[segment] + lRateOfTurn[segment] * tSinceL
+
+    # Trajectory error: position just before each report vs. the report
+    errorFrame = reportFrame[1:] - 1
+    aE = np.column_stack(
+        (np.abs(aX[errorFrame] - aisX[1:]), np.abs(aY[errorFrame] - aisY[1:]))
+    )
+    return [aX, aY, aC, T, aE]
@@ -0,0 +1,488 @@
+import math
+from abc import ABC, abstractmethod
+import numpy as np
+from .agb import AISReport, VesselState, pickInterpType
+from .libUKF import UKF, SquareRootUKF
+from .ukf import iterate_x
+from .utils import wrapToPi, rad2course, calcTrajectoryError, propagateCovariance
+
+# Stateful trackers, evaluated only at the frame times a client asks for:
+#
+#   tracker = RateTurnTracker()
+#   tracker.ingest(AISReport(time, x, y, speed, course))  # as reports arrive
+#   state = tracker.position_at(t)  # VesselState at (VR) frame time t
+#
+# Reports use the AISReport fields of agb.py: time (s), posX/posY (m),
+# speed (ms-1), course (degrees). VesselState.course is in radians.
+# position_at(t) is None before the first report.
+# Closed-form models (DR, ROT, PVB) are evaluated directly at t. Step-based
+# predictors (AGB) advance their model to t in steps of at most 1 / estFreq.
+# Filters (EKF, XKF, UKF) step their state only on a fixed 1 / estFreq grid from
+# the first report, and take each report at the first grid time at or after it
+# (as the batch versions), so the state does not depend on how often positions
+# are asked for. position_at(t) extrapolates from the last grid state at or
+# before t without changing it. Filters only move forward: position_at(t)
+# before the current grid time returns the current state. With
+# eventCovariance, EKF and XKF step only their state, the covariance is
+# propagated in one step at each report (as the batch versions with
+# eventCovariance).
+
+
+class Tracker(ABC):
+    @abstractmethod
+    def ingest(self, report):
+        pass
+
+    @abstractmethod
+    def position_at(self, t):
+        pass
+
+
+class SteppedTracker(Tracker):
+    # Model stepped on a fixed grid of 1 / estFreq from the first report
+    # Subclasses set startTime at their first report
+
+    def __init__(self, estFreq):
+        self.maxStep = 1 / estFreq
+        self.startTime = None  # time of the first report (grid origin)
+        self.frame = 0  # grid frame of the current state
+        self.time = None  # time of the current state
+
+    @abstractmethod
+    def step(self, h):
+        pass
+
+    @abstractmethod
+    def extrapolate(self, h):
+        # VesselState h seconds after the current state, the state is unchanged
+        pass
+
+    def advance(self, t, report=False):
+        # Full steps to the last grid time at or before t, or for a report the
+        # first grid time at or after it (1e-9: times on the grid up to rounding)
+        lastFrame = (t - self.startTime) / self.maxStep
+        lastFrame = math.ceil(lastFrame - 1e-9) if report else math.floor(lastFrame + 1e-9)
+        while self.frame < lastFrame:
+            self.step(self.maxStep)
+            self.frame += 1
+        self.time = self.startTime + self.frame * self.maxStep
+
+    def position_at(self, t):
+        if self.startTime is None:
+            return None  # No report yet
+        self.advance(t)
+        return self.extrapolate(max(t - self.time, 0))
+
+
+class DeadReckoningTracker(Tracker):
+    def __init__(self):
+        self.report = None  # latest report
+
+    def ingest(self, report):
+        self.report = report
+
+    def position_at(self, t):
+        report = self.report
+        if report is None:
+            return None
+        course = math.radians(report.course)
+        tSinceL = t - report.time
+        return VesselState(
+            report.posX + report.speed * math.sin(course) * tSinceL,
+            report.posY + report.speed * math.cos(course) * tSinceL,
+            report.speed,
+            course,
+        )
+
+
+class RateTurnTracker(Tracker):
+    # Circular arc with the rate of turn between the last two reports (as rot.py)
+
+    def __init__(self):
+        self.report = None
+        self.rateOfTurn = 0  # radians per second
+
+    def ingest(self, report):
+        if self.report is not None and report.time > self.report.time:
+            self.rateOfTurn = math.radians(
+                (report.course - self.report.course) / (report.time - self.report.time)
+            )
+        self.report = report
+
+    def position_at(self, t):
+        report = self.report
+        if report is None:
+            return None
+        c0 = math.radians(report.course)
+        w = self.rateOfTurn
+        tSinceL = t - report.time
+        c = c0 + w * tSinceL
+        if abs(w) > 1e-9:
+            radius = report.speed / w
+            posX = report.posX + radius * (math.cos(c0) - math.cos(c))
+            posY = report.posY + radius * (math.sin(c) - math.sin(c0))
+        else:
+            posX = report.posX + report.speed * math.sin(c0) * tSinceL
+            posY = report.posY + report.speed * math.cos(c0) * tSinceL
+        return VesselState(posX, posY, report.speed, c)
+
+
+class ProjectiveVelocityTracker(Tracker):
+    # Projective velocity blending (as pvb.py), dead reckoning until the second report
+
+    def __init__(self):
+        self.report = None
+        self.oPos = np.zeros(2)  # position at the latest report, before it arrived
+        self.oVelocity = np.zeros(2)
+        self.lPos = np.zeros(2)
+        self.lVelocity = np.zeros(2)
+        self.tDelta = 0  # time between the last two reports
+
+    def ingest(self, report):
+        if self.report is not None:
+            state = self.position_at(report.time)
+            self.oPos = np.array([state.posX, state.posY])
+            self.oVelocity = self.lVelocity
+            self.tDelta = report.time - self.report.time
+        course = math.radians(report.course)
+        self.lPos = np.array([report.posX, report.posY])
+        self.lVelocity = report.speed * np.array([math.sin(course), math.cos(course)])
+        self.report = report
+
+    def position_at(self, t):
+        if self.report is None:
+            return None
+        tSinceL = t - self.report.time
+        if self.tDelta <= 0:  # No previous report to blend from
+            posComb = self.lPos + self.lVelocity * tSinceL
+            bVelocity = self.lVelocity
+        else:
+            tHat = tSinceL / self.tDelta
+            bVelocity = self.oVelocity + (self.lVelocity - self.oVelocity) * tHat
+            posProj = self.oPos + bVelocity * tSinceL
+            posLast = self.lPos + self.lVelocity * tSinceL
+            posComb = posProj + (posLast - posProj) * tHat
+        return VesselState(
+            posComb[0],
+            posComb[1],
+            math.hypot(bVelocity[0], bVelocity[1]),
+            math.atan2(bVelocity[0], bVelocity[1]),
+        )
+
+
+class AGBTracker(Tracker):
+    # own_algo (agb.py): predictors from the last reports, blended after each report
+    # config = [interpolationType, blendingPercentage], e.g. ["P2_Quad", 0.5]
+
+    def __init__(self, config, estFreq=60):
+        self.config = config
+        self.maxStep = 1 / estFreq
+        self.aisReports = []  # Max int(config[0][1]) reports
+        self.predictors = []  # Max 2 [predictor, time of its state]: prev and current
+        self.reportTime = None
+        self.reportingTime = 0
+
+    def ingest(self, report):
+        if len(self.aisReports) == int(self.config[0][1]):
+            self.aisReports.pop(0)
+        self.aisReports.append(report)
+        if len(self.predictors) == 2:
+            self.predictors.pop(0)
+        self.predictors.append([pickInterpType(self.aisReports, self.config), report.time])
+        if self.reportTime is not None:
+            self.reportingTime = report.time - self.reportTime
+        self.reportTime = report.time
+
+    def position_at(self, t):
+        if not self.predictors:
+            return None
+        states = []
+        for predictorTime in self.predictors:
+            predictor, time = predictorTime
+            while time < t:
+                h = min(self.maxStep, t - time)
+                predictor.predict(h)
+                time = t if h < self.maxStep else time + h
+            predictorTime[1] = time
+            states.append(predictor.state)
+        if len(states) == 1:
+            return states[0]
+        stateOld, stateNew = states
+        blendPercentage = self.config[1]
+        if blendPercentage == 0 or self.reportingTime <= 0:
+            blendWeight = 1
+        else:
+            blendWeight = min((t - self.reportTime) / (self.reportingTime * blendPercentage), 1)
+        return VesselState(
+            stateOld.posX + (stateNew.posX - stateOld.posX) * blendWeight,
+            stateOld.posY + (stateNew.posY - stateOld.posY) * blendWeight,
+            stateOld.speed + (stateNew.speed - stateOld.speed) * blendWeight,
+            math.remainder(stateOld.course + 2 * math.pi, 2 * math.pi)
+            + math.remainder(stateNew.course - stateOld.course + 2 * math.pi, 2 * math.pi)
+            * blendWeight,
+        )
+
+
+def getFossenChi(report, prevReport):
+    # Course (radians, from east) from the previous report position, from the
+    # origin for the first report (as utils.computeFossenChi in the batch filters)
+    if prevReport is None:
+        return math.atan2(report.posY, report.posX)
+    return math.atan2(report.posY - prevReport.posY, report.posX - prevReport.posX)
+
+
+class EKFTracker(SteppedTracker):
+    # extended_kalman (ekf.py): X = [x y U chi]
+
+    Q = np.diag([0.01, 0.01, 0.1, 0.1])
+    R = np.diag([0.001, 0.001, 0.001, 0.01])
+
+    def __init__(self, estFreq=50, eventCovariance=False):
+        super().__init__(estFreq)
+        self.eventCovariance = eventCovariance
+        self.report = None
+        self.X = None
+        self.P = 0.1 * np.eye(4)
+        self.steps = 0  # steps of maxStep since P (eventCovariance)
+
+    def ingest(self, report):
+        chi = getFossenChi(report, self.report)
+        self.report = report
+        if self.X is None:
+            self.X = np.array([report.posX, report.posY, report.speed, chi])
+            self.startTime = report.time
+        self.advance(report.time, report=True)
+        if self.eventCovariance and self.steps > 0:
+            U, chi_hat = self.X[2], self.X[3]
+            F = np.zeros((4, 4))
+            F[0, 2:] = [math.cos(chi_hat), -U * math.sin(chi_hat)]
+            F[1, 2:] = [math.sin(chi_hat), U * math.cos(chi_hat)]
+            self.P = propagateCovariance(self.P, F, self.Q, self.steps, self.maxStep)
+            self.steps = 0
+        eps = np.array([report.posX, report.posY, report.speed, chi]) - self.X
+        eps[3] = wrapToPi(eps[3])
+        # K = P (P + R)^-1
+        K = np.linalg.solve(self.P + self.R, self.P).T
+        IK = np.eye(4) - K
+        self.X = self.X + K @ eps
+        self.P = IK @ self.P @ IK.T + K @ self.R @ K.T
+
+    def step(self, h):
+        U, chi = self.X[2], self.X[3]
+        f = np.array([U * math.cos(chi), U * math.sin(chi), 0, 0])
+        self.X = self.X + h * f
+        if self.eventCovariance:
+            self.steps += 1
+            return
+        PHI = np.eye(4)
+        PHI[0, 2:] = [h * math.cos(chi), -h * U * math.sin(chi)]
+        PHI[1, 2:] = [h * math.sin(chi), h * U * math.cos(chi)]
+        self.P = PHI @ self.P @ PHI.T + self.Q
+
+    def extrapolate(self, h):
+        U, chi = self.X[2], self.X[3]
+        return VesselState(
+            self.X[0] + h * U * math.cos(chi), self.X[1] + h * U * math.sin(chi), U, math.pi / 2 - chi
+        )
+
+
+class XKFTracker(SteppedTracker):
+    # exogenous_kalman (xkf.py): kinematic observer feeding an LTV Kalman filter
+
+    K1, K2, K3, K4 = 10, 10, 30, 50  # observer gains
+    Q = np.diag([1, 1, 10, 10])
+    R = np.eye(4)
+    T_a = 10  # acceleration time constant
+    T_r = 50  # yaw rate time constant
+    r_max = np.pi / 180
+    a_max = 1
+
+    def __init__(self, estFreq=40, eventCovariance=False):
+        super().__init__(estFreq)
+        self.eventCovariance = eventCovariance
+        self.reports = []  # last 3 (time, speed, chi)
+        self.count = 0  # reports so far
+        self.report = None
+        self.P = np.eye(4)
+        self.a = 0
+        self.r = 0
+        self.a_c = 0
+        self.r_c = 0
+        self.sumHF = np.zeros((4, 4))  # sum of h F since P (eventCovariance)
+        self.steps = 0  # steps of maxStep since P (eventCovariance)
+
+    def ingest(self, report):
+        chi_k = getFossenChi(report, self.report)
+        self.report = report
+        if self.count == 0:
+            self.obs = np.array([report.posX, report.posY, report.speed, chi_k])
+            self.x_hat = self.obs.copy()
+            self.U_k = report.speed
+            self.startTime = report.time
+        self.advance(report.time, report=True)
+        self.reports = (self.reports + [(report.time, report.speed, chi_k)])[-3:]
+
+        # estimate of acceleration and yaw rate for sample k > 2
+        if self.count > 2:
+            (t2, U2, chi2), (t1, U1, chi1), (t0, U0, chi0) = self.reports
+            h1 = t0 - t1
+            h2 = t1 - t2
+            # not if mean sampling time > 4s, or across a repeated time
+            if (h1 + h2) / 2 > 4 or h1 <= 0 or h2 <= 0:
+                a_c = 0
+                r_c = 0
+            else:
+                alp = ((h1 + h2) / h1) ** 2
+                a_c = ((1 - alp) * U0 + alp * U1 - U2) / ((1 - alp) * h1 + h2)
+                r_c = ((1 - alp) * chi0 + alp * chi1 - chi2) / ((1 - alp) * h1 + h2)
+        else:  # zero for first two data points
+            a_c = 0
+            r_c = 0
+        # max values (saturation) to avoid estimates using wildpoints
+        if r_c > self.r_max:
+            r_c = self.r_max
+        elif self.r < -self.r_max:
+            r_c = -self.r_max
+        self.a_c = min(max(a_c, -self.a_max), self.a_max)
+        self.r_c = r_c
+
+        if self.eventCovariance and self.steps > 0:
+            # mean F over the steps since the last report
+            F = self.sumHF / (self.steps * self.maxStep)
+            self.P = propagateCovariance(self.P, F, self.Q, self.steps, self.maxStep)
+            self.sumHF[:] = 0
+            self.steps = 0
+
+        # Corrector Kalman filter
+        z_k = np.array([report.posX, report.posY, report.speed, chi_k])
+        eps = z_k - self.x_hat
+        eps[3] = wrapToPi(eps[3])
+        K = np.linalg.solve(self.P + self.R, self.P).T  # P (P + R)^-1 (H = I)
+        IK = np.eye(4) - K
+        self.x_hat = self.x_hat + K @ eps
+        self.P = IK @ self.P @ IK.T + K @ self.R @ K.T
+
+        # Corrector kinematic observer
+        h = self.maxStep
+        gains = np.array([self.K1, self.K2, self.K3, self.K4])
+        innovation = z_k - self.obs
+        innovation[3] = wrapToPi(innovation[3])
+        self.obs = self.obs + h * gains * innovation
+        self.U_k = report.speed
+        self.count += 1
+
+    def step(self, h):
+        U, chi = self.obs[2], self.obs[3]
+        f_prd = np.array([U * math.cos(chi), U * math.sin(chi), 0, 0])
+        F = np.zeros((4, 4))
+        F[2, :2] = [math.cos(chi), math.sin(chi)]
+        F[3, :2] = [-U * math.sin(chi), U * math.cos(chi)]
+
+        # Predictor Kalman filter
+        self.x_hat = self.x_hat + h * (
+            f_prd + F @ (self.x_hat - self.obs) + np.array([0, 0, self.a, self.r])
+        )
+        self.x_hat[3] = wrapToPi(self.x_hat[3])
+        if self.eventCovariance:
+            self.sumHF += h * F
+            self.steps += 1
+        else:
+            PHI = np.eye(4) + h * F
+            self.P = PHI @ self.P @ PHI.T + self.Q
+
+        # Predictor kinematic observer
+        self.obs = self.obs + h * np.array(
+            [self.U_k * math.cos(chi), self.U_k * math.sin(chi), self.a, self.r]
+        )
+        self.obs[3] = wrapToPi(self.obs[3])
+        self.a = self.a + (self.a_c - self.a) / self.T_a
+        self.r = self.r + (self.r_c - self.r) / self.T_r
+
+    def extrapolate(self, h):
+        U, chi = self.obs[2], self.obs[3]
+        return VesselState(
+            self.x_hat[0] + h * U * math.cos(chi),
+            self.x_hat[1] + h * U * math.sin(chi),
+            self.x_hat[2],
+            math.pi / 2 - (chi + h * self.r),
+        )
+
+
+class UKFTracker(SteppedTracker):
+    # unscented_kalman (ukf.py): x, y, course, speed, yaw rate, acceleration
+
+    q = np.diag([0.01, 0.01, 0.1, 0.1, 0, 0])
+    r_matrix = np.diag([1, 1, 0.001, 0.01])
+
+    def __init__(self, estFreq=60, squareRoot=False):
+        super().__init__(estFreq)
+        self.squareRoot = squareRoot  # SquareRootUKF, for long unattended runs
+        self.state_estimator = None
+        self.measure = None
+
+    def ingest(self, report):
+        course = wrapToPi(math.radians(report.course))
+        if self.state_estimator is None:
+            self.state_estimator = (SquareRootUKF if self.squareRoot else UKF)(
+                6,
+                self.q,
+                np.array([[report.posX], [report.posY], [course], [report.speed], [0], [0]]),
+                0.0001 * np.eye(6),
+                0.04,
+                0.0,
+                2.0,
+                iterate_x,
+            )
+            self.state_estimator.modStates(
+                [
+                    [0, 0, 0, 0, 1, 0],
+                    [0, 0, 0, 0, 0, 1],
+                    [0, 0, 1, 0, 0, 0],
+                    [0, 0, 0, 1, 0, 0],
+                ]
+            )
+            self.startTime = report.time
+        self.advance(report.time, report=True)
+        self.measure = np.array([0, 0, course, report.speed]).reshape(-1, 1)
+
+    def step(self, h):
+        self.state_estimator.predict(h)
+        self.state_estimator.update(self.measure, self.r_matrix)
+
+    def extrapolate(self, h):
+        estiList = iterate_x(self.state_estimator.get_state(), h)
+        return VesselState(estiList[0][0], estiList[1][0], estiList[3][0], estiList[2][0])
+
+
+def trackReports(tracker, aisData, T):
+    # Drives a tracker over recorded aisData at any frame times T (not only a
+    # fixed estFreq grid) >> [aX, aY, aC, aT, aE] as the batch trackers
+    aX = []
+    aY = []
+    aT = []
+    aE = []
+    aC = []
+    k = 0
+    for t in T:
+        newReport = False
+        while k < len(aisData["time"]) and aisData["time"][k] <= t:
+            calcTrajectoryError(aE, aX, aY, aisData["x"][k], aisData["y"][k])
+            tracker.ingest(
+                AISReport(
+                    aisData["time"][k],
+                    aisData["x"][k],
+                    aisData["y"][k],
+                    aisData["speed"][k],
+                    aisData["course"][k],
+                )
+            )
+            newReport = True
+            k += 1
+        if k == 0:  # Nothing to track before the first report
+            continue
+        state = tracker.position_at(t)
+        aX.append(state.posX)
+        aY.append(state.posY)
+        aC.append(rad2course(state.course))
+        aT.append(t)
+    return [aX, aY, aC, aT, aE]
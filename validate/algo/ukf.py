@@ -2,7 +2,7 @@ import math
 import copy
 import numpy as np
 
-from .libUKF import UKF
+from .libUKF import UKF, SquareRootUKF
 from .utils import course2Rad, rad2course
 from .utils import calcTrajectoryError
 
@@ -19,10 +19,9 @@ def iterate_x(x_in, timestep):
     return ret
 
 
-def unscented_kalman(aisData):
+def unscented_kalman(aisData, estFreq=60, squareRoot=False):
     aisData = copy.deepcopy(aisData)
     aisData["course"] = course2Rad(aisData)  # in Radians
-    estFreq = 60  # in Hertz
     h = 1 / estFreq
     T = np.arange(0, aisData["duration"], 1 / estFreq)
     aX = []
@@ -35,7 +34,8 @@ def unscented_kalman(aisData):
     q = np.diag([0.01, 0.01, 0.1, 0.1, 0, 0])
     # yaw rate, acceleration, course, speed
     r_matrix = np.diag([1, 1, 0.001, 0.01])
-    state_estimator = UKF(
+    # squareRoot: SquareRootUKF, covariance kept as a Cholesky factor (long runs)
+    state_estimator = (SquareRootUKF if squareRoot else UKF)(
         6,
         q,
         np.matrix(
@@ -53,6 +53,7 @@ def unscented_kalman(aisData):
         0.0,
         2.0,
         iterate_x,
+        lock=False,  # only used by this loop
     )
     state_estimator.modStates(
         [
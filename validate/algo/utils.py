@@ -51,3 +51,49 @@ def calcTrajectoryError(errList, aX, aY, aisX, aisY):
         errList.append([errX, errY])
     except:
         pass
+
+
+def getReportFrames(T, aisTime):
+    # Frames where the per-frame trackers take each report: the first frame at
+    # or after its time, at most one report per frame (a late report is taken
+    # on the following frame). The last report only ends the track.
+    # >> report indices, their frames, end of the output frames
+    aisTime = np.asarray(aisTime, dtype=np.float64)
+    k = np.arange(len(aisTime) - 1)
+    reportFrame = np.maximum.accumulate(np.searchsorted(T, aisTime[:-1]) - k) + k
+    k = k[reportFrame < len(T)]
+    reportFrame = reportFrame[reportFrame < len(T)]
+    lastFrame = len(T)
+    if len(k) > 0 and k[-1] == len(aisTime) - 2:
+        lastFrame = max(reportFrame[-1] + 1, np.searchsorted(T, aisTime[-1]))
+    return k, reportFrame, lastFrame
+
+
+def getErrors(aX, aY, aisData, k, reportFrame):
+    # Trajectory error: output of the frame before each report vs. the report
+    k = k[reportFrame > 0]
+    errorFrame = reportFrame[reportFrame > 0] - 1
+    return np.column_stack(
+        (
+            np.abs(aX[errorFrame] - np.asarray(aisData["x"])[k]),
+            np.abs(aY[errorFrame] - np.asarray(aisData["y"])[k]),
+        )
+    )
+
+
+def propagateCovariance(P, F, Q, m, h):
+    # P after m steps of P = PHI P PHI^T + Q, PHI = I + h F, in one step.
+    # For F @ F = 0 (EKF and XKF Jacobians) PHI^m = I + m h F and the Q terms
+    # sum in closed form: exact for a constant F, for a varying F pass its mean
+    # over the steps. P, F (..., n, n), m (...) steps, not necessarily whole
+    m = np.asarray(m, dtype=np.float64)[..., None, None]
+    PHI = np.eye(len(Q)) + m * h * F
+    hFQ = h * F @ Q
+    s1 = m * (m - 1) / 2  # sum of j, j < m
+    s2 = m * (m - 1) * (2 * m - 1) / 6  # sum of j^2
+    return (
+        PHI @ P @ np.swapaxes(PHI, -1, -2)
+        + m * Q
+        + s1 * (hFQ + np.swapaxes(hFQ, -1, -2))
+        + s2 * (hFQ @ np.swapaxes(h * F, -1, -2))
+    )
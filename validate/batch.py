@@ -0,0 +1,188 @@
+import os
+import sys
+import csv
+import glob
+import time
+import numpy as np
+from multiprocessing import Pool
+from algo.dr import dead_reckoning
+from algo.ekf import extended_kalman, extended_kalman_fleet
+from algo.xkf import exogenous_kalman, exogenous_kalman_fleet
+from algo.ukf import unscented_kalman
+from algo.pvb import projective_velocity_blending
+from algo.agb import own_algo
+from algo.rot import rate_turn
+
+# Batch trajectory reconstruction: every vessel of an Octave export
+# (out/vessel_{mmsi}.octave.csv from extract.py, or one file with all vessels)
+# through one tracker in a process pool. Each vessel's trajectory is written to
+#   {storeDir}/{algo}/vessel_{mmsi}.npy  (trackRecord array)
+# by the worker itself, so nothing but a summary goes back to the parent.
+#
+#   runBatch(glob.glob("../out/vessel_*.octave.csv"), "ROT")
+#   tracks = loadTracks("ROT")  # MMSI >> memory-mapped trackRecord array
+#
+# Trackers with a fleet version (fleetTrackers) run one batched fleet per
+# process instead of one vessel per task.
+# A vessel that raises does not stop the batch: it is reported in the summary
+# with its error (a failing fleet is rerun one vessel at a time).
+
+trackers = {
+    "DR": dead_reckoning,
+    "EKF": extended_kalman,
+    "XKF": exogenous_kalman,
+    "UKF": unscented_kalman,
+    "PVB": projective_velocity_blending,
+    "AGB": own_algo,
+    "ROT": rate_turn,
+}
+
+fleetTrackers = {
+    "EKF": extended_kalman_fleet,
+    "XKF": exogenous_kalman_fleet,
+}
+
+trackRecord = np.dtype(
+    [("time", "<f8"), ("x", "<f8"), ("y", "<f8"), ("course", "<f8")]
+)
+
+defaultStoreDir = "../out/tracks"
+minReports = 3  # Vessels with fewer reports are skipped
+
+
+def readAISReports(fileNames):
+    # Octave CSV rows (epoch, mmsi, x, y, speed, course) >> MMSI >> report rows
+    reports = {}
+    for fileName in fileNames:
+        with open(fileName, "r") as csvFile:
+            for epoch, mmsi, x, y, speed, course in csv.reader(csvFile):
+                reports.setdefault(int(mmsi), []).append(
+                    (float(epoch), float(x), float(y), float(speed), float(course))
+                )
+    return reports
+
+
+def toAISData(vesselReports):
+    # Report rows >> aisData dict as in real.py (time from 0, speed in ms-1)
+    vesselReports = sorted(vesselReports, key=lambda report: report[0])
+    tZero = vesselReports[0][0]
+    aisT = [report[0] - tZero for report in vesselReports]
+    return {
+        "time": aisT,
+        "x": [report[1] for report in vesselReports],
+        "y": [report[2] for report in vesselReports],
+        "course": [report[4] for report in vesselReports],
+        "speed": [report[3] / 1.94384 for report in vesselReports],
+        "duration": aisT[-1] - aisT[0],
+    }
+
+
+def getTrackPath(storeDir, algo, mmsi):
+    return f"{storeDir}/{algo}/vessel_{mmsi}.npy"
+
+
+def saveTrack(mmsi, aX, aY, aC, aT, algo, storeDir):
+    track = np.zeros(len(aT), dtype=trackRecord)
+    track["time"] = aT
+    track["x"] = aX
+    track["y"] = aY
+    track["course"] = aC
+    np.save(getTrackPath(storeDir, algo, mmsi), track)
+    return len(track)
+
+
+def getError(exception):
+    return f"{type(exception).__name__}: {exception}"
+
+
+def runTracker(mmsi, aisData, algo, config, storeDir):
+    # Worker: one vessel through one tracker, trajectory written to the store
+    # >> (mmsi, frames, seconds, error), error is None unless the tracker raised
+    startTime = time.time()
+    try:
+        if algo == "AGB":
+            aX, aY, aC, aT, aE = trackers[algo](aisData, config)
+        else:
+            aX, aY, aC, aT, aE = trackers[algo](aisData)
+        frames = saveTrack(mmsi, aX, aY, aC, aT, algo, storeDir)
+    except Exception as exception:
+        return mmsi, 0, time.time() - startTime, getError(exception)
+    return mmsi, frames, time.time() - startTime, None
+
+
+def runFleet(tasks):
+    # Worker: the vessels of tasks through one fleet tracker
+    # >> [(mmsi, frames, seconds, error)], seconds: share of the fleet time
+    startTime = time.time()
+    algo, storeDir = tasks[0][2], tasks[0][4]
+    try:
+        tracks = fleetTrackers[algo]([task[1] for task in tasks])
+    except Exception:
+        # Find the failing vessels with the single vessel tracker
+        return [runTracker(*task) for task in tasks]
+    results = []
+    for task, (aX, aY, aC, aT, aE) in zip(tasks, tracks):
+        try:
+            results.append([task[0], saveTrack(task[0], aX, aY, aC, aT, algo, storeDir), None])
+        except Exception as exception:
+            results.append([task[0], 0, getError(exception)])
+    seconds = (time.time() - startTime) / len(tasks)
+    return [(mmsi, frames, seconds, error) for mmsi, frames, error in results]
+
+
+def runBatch(fileNames, algo="DR", config=[], processes=None, storeDir=defaultStoreDir):
+    # Returns MMSI >> (frames, seconds, error) for every vessel, error is None
+    # unless its tracker raised (no track is stored for it)
+    os.makedirs(f"{storeDir}/{algo}", exist_ok=True)
+    tasks = []
+    for mmsi, vesselReports in readAISReports(fileNames).items():
+        if len(vesselReports) < minReports:
+            continue
+        aisData = toAISData(vesselReports)
+        if aisData["duration"] <= 0:
+            continue
+        tasks.append((mmsi, aisData, algo, config, storeDir))
+    # Longest tracks first, so one big vessel does not finish last on its own
+    tasks.sort(key=lambda task: task[1]["duration"], reverse=True)
+    processes = processes or os.cpu_count()
+    summary = {}
+    with Pool(processes) as pool:
+        if algo in fleetTrackers:
+            # One fleet per process, each with its share of long and short tracks
+            fleets = [tasks[i::processes] for i in range(processes)]
+            results = [
+                result
+                for fleetResults in pool.map(runFleet, [fleet for fleet in fleets if fleet])
+                for result in fleetResults
+            ]
+        else:
+            results = pool.starmap(runTracker, tasks)
+        for mmsi, frames, seconds, error in results:
+            summary[mmsi] = (frames, seconds, error)
+    return summary
+
+
+def loadTracks(algo, storeDir=defaultStoreDir):
+    # MMSI >> memory-mapped trackRecord array
+    tracks = {}
+    for trackPath in glob.glob(getTrackPath(storeDir, algo, "*")):
+        mmsi = int(os.path.basename(trackPath)[len("vessel_") : -len(".npy")])
+        tracks[mmsi] = np.load(trackPath, mmap_mode="r")
+    return tracks
+
+
+if __name__ == "__main__":
+    # RUN: python batch.py [algo] [file pattern]  (e.g. ROT "../out/vessel_*.octave.csv")
+    algo = sys.argv[1] if len(sys.argv) > 1 else "DR"
+    pattern = sys.argv[2] if len(sys.argv) > 2 else "../out/vessel_*.octave.csv"
+    config = ["P2_Quad", 0.5] if algo == "AGB" else []
+    startTime = time.time()
+    summary = runBatch(sorted(glob.glob(pattern)), algo, config)
+    failed = 0
+    for mmsi, (frames, seconds, error) in sorted(summary.items()):
+        if error is not None:
+            print(f"vessel_{mmsi}: failed, {error}")
+            failed += 1
+        else:
+            print(f"vessel_{mmsi}: {frames} frames, {seconds:.2f} s")
+    print(f"{len(summary)} vessels ({failed} failed) in {time.time() - startTime:.2f} s")
@@ -23,10 +23,10 @@ tZero = None
 for line in trial:
     epoch, mmsi, x, y, speed, course = line.strip().split(",")
     if tZero is None:
-        tZero = int(epoch)
+        tZero = float(epoch)  # whole seconds or ms receive times
         aisT.append(0)
     else:
-        aisT.append(int(epoch) - tZero)
+        aisT.append(float(epoch) - tZero)
     aisX.append(float(x))
     aisY.append(float(y))
     aisS.append(float(speed) / 1.94384)
@@ -34,7 +34,7 @@ for line in trial:
 
 estFreq = 60  # Hertz
 trialTime = aisT[-1]
-T = np.linspace(0, trialTime, trialTime * estFreq)
+T = np.linspace(0, trialTime, int(trialTime * estFreq))
 
 aisData = {
     "time": aisT,